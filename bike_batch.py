@@ -0,0 +1,328 @@
+"""NumPy によるバッチシミュレータ
+
+N 個の独立したゲームを NumPy 配列（バイクの y・速度・ジャンプ中・クラッシュ、障害物と坂のリングバッファ）で保持し、
+1回の step() で全ゲームをまとめて1ティック進める。生成間隔のタイマーは配列でまとめて進め、出現の抽選だけを
+ゲームごとの random.Random(seed) で course_placements と同じ順番に行うので、同じシード・同じ入力なら
+Simulation と同じ結果になる（ゲームごとにジェネレータを毎ティック回すより数割速い）。
+
+    python bike_batch.py --games 10000 --ticks 36000 --verify 20
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+import numpy as np
+
+import bike_game
+from bike_game import (WIDTH, HEIGHT, SCROLL_SPEED, DEFAULT_RULES, OBSTACLE_TYPES, REFLEX_LOOKAHEAD, Obstacle, Slope,
+                       obstacle_weights, percentile)
+
+GROUND_Y = HEIGHT - 140
+
+def buffer_slots(interval, max_width):
+    """interval ティックごとに出現するものが画面上に同時に存在しうる数（リングバッファの大きさ）"""
+    return (WIDTH + max_width) // (SCROLL_SPEED * max(1, interval)) + 2
+
+def round_half_away(values):
+    """pygame.Rect に小数を代入したときと同じ丸め（0.5 は 0 から遠い方へ）"""
+    return np.trunc(values + np.copysign(0.5, values)).astype(np.int64)
+
+# 坂のめり込みの表で「めり込む列がない」ことを表す値（持ち上げる量が必ず負になる）
+NO_DEPTH = -10 ** 6
+
+def clearance_tables(image):
+    """バイクの画像と下り坂・上り坂のめり込みの表（MaskCache.clearance）を (2, 長さ) の配列にする"""
+    tables = [bike_game.masks.clearance(image, bike_game.textures.get(slope_type, Slope.WIDTH, Slope.HEIGHT))
+              for slope_type in ("down", "up")]
+    return np.array([[NO_DEPTH if depth is None else depth for depth in table] for table in tables], dtype=np.int64)
+
+def summed_mask(image):
+    """画像のマスクの累積和（(高さ + 1, 幅 + 1) の配列、[y, x] は左上 x * y の範囲の不透明なピクセル数）"""
+    mask = bike_game.masks.get(image)
+    width, height = mask.get_size()
+    bits = np.array([[mask.get_at((x, y)) for x in range(width)] for y in range(height)], dtype=np.int64)
+    table = np.zeros((height + 1, width + 1), dtype=np.int64)
+    table[1:, 1:] = bits.cumsum(axis=0).cumsum(axis=1)
+    return table
+
+def opaque_in(table, left, top, right, bottom):
+    """累積和 table のマスクで、矩形 [left, right) x [top, bottom) にある不透明なピクセルの数
+
+    障害物のテクスチャはすべて不透明なので、バイクのマスクと障害物のマスクが重なるかは
+    バイクのマスクのうち障害物の矩形に入る部分にピクセルがあるかで分かる。
+    """
+    height, width = table.shape[0] - 1, table.shape[1] - 1
+    left, right = np.clip(left, 0, width), np.clip(right, 0, width)
+    top, bottom = np.clip(top, 0, height), np.clip(bottom, 0, height)
+    return table[bottom, right] - table[top, right] - table[bottom, left] + table[top, left]
+
+def slope_lift(depths, bike_x, bike_w, y, slope_x, slope_up, candidates):
+    """Bike._rest_on_slopes と同じく、坂にめり込んだ分だけ持ち上げる量（candidates は矩形が重なる坂）
+
+    depths は clearance_tables の表、slope_x は坂が動く前の位置。
+    """
+    index = np.clip(bike_x - slope_x + bike_w - 1, 0, depths.shape[1] - 1)
+    lift = y - (GROUND_Y - Slope.HEIGHT) + depths[slope_up.astype(np.int64), index] + 1
+    return np.where(candidates, lift, 0).max(axis=-1, initial=0)
+
+class BatchSimulation:
+    """N 個のゲームを配列で同時に進めるシミュレータ"""
+    def __init__(self, seeds, game_mode="single", rules=None):
+        self.game_mode = game_mode
+        self.rules = dict(DEFAULT_RULES, **(rules or {}))
+        self.gravity = self.rules["gravity"]
+        self.jump_velocity = self.rules["jump_velocity"]
+        self.obstacle_slots = buffer_slots(self.rules["spawn_min"], Obstacle.BLOCK_WIDTH[1])
+        self.slope_slots = buffer_slots(self.rules["slope_interval"], Slope.WIDTH)
+
+        # バイクの位置と大きさは Bike と同じ（プレイヤー1は左側、プレイヤー2は右側）
+        bike_types = ["bike1"] if game_mode == "single" else ["bike1", "bike2"]
+        sizes = [bike_game.assets.get(bike_type).get_size() for bike_type in bike_types]
+        self.bike_x = np.array([80, 120][:len(bike_types)], dtype=np.int64)
+        self.bike_w = np.array([w for w, _ in sizes], dtype=np.int64)
+        self.bike_h = np.array([h for _, h in sizes], dtype=np.int64)
+        self.bike_centerx = self.bike_x + self.bike_w // 2
+        # 精密な衝突判定に使う表（バイクごと）
+        self.depths = [clearance_tables(bike_game.assets.get(bike_type)) for bike_type in bike_types]
+        self.summed_masks = [summed_mask(bike_game.assets.get(bike_type)) for bike_type in bike_types]
+        self.reset(seeds)
+
+    def reset(self, seeds):
+        self.seeds = list(seeds)
+        n = len(self.seeds)
+        bikes = len(self.bike_x)
+        self.rngs = [random.Random(seed) for seed in self.seeds]
+
+        self.y = np.full((n, bikes), HEIGHT - 140 - 40, dtype=np.int64)
+        self.velocity_y = np.zeros((n, bikes))
+        self.jumping = np.zeros((n, bikes), dtype=bool)
+        self.crashed = np.zeros((n, bikes), dtype=bool)
+
+        # 障害物のリングバッファ
+        self.obstacle_x = np.zeros((n, self.obstacle_slots), dtype=np.int64)
+        self.obstacle_w = np.zeros((n, self.obstacle_slots), dtype=np.int64)
+        self.obstacle_h = np.zeros((n, self.obstacle_slots), dtype=np.int64)
+        self.obstacle_type = np.zeros((n, self.obstacle_slots), dtype=np.int8)
+        self.obstacle_active = np.zeros((n, self.obstacle_slots), dtype=bool)
+        self.obstacle_count = np.zeros(n, dtype=np.int64)
+
+        # 坂のリングバッファ（seq は出現順。重なったときは古い方を使う）
+        self.slope_x = np.zeros((n, self.slope_slots), dtype=np.int64)
+        self.slope_up = np.zeros((n, self.slope_slots), dtype=bool)
+        self.slope_active = np.zeros((n, self.slope_slots), dtype=bool)
+        self.slope_seq = np.zeros((n, self.slope_slots), dtype=np.int64)
+        self.slope_count = np.zeros(n, dtype=np.int64)
+
+        self.frame = np.zeros(n, dtype=np.int64)
+        self.score = np.zeros(n)
+        self.obstacle_timer = np.zeros(n, dtype=np.int64)
+        self.slope_timer = np.zeros(n, dtype=np.int64)
+        self.game_over = np.zeros(n, dtype=bool)
+
+    def _spawn_obstacle(self, game):
+        """course_placements と同じ順番で乱数を引いて障害物を出現させる"""
+        rng = self.rngs[game]
+        obstacle_type = rng.choices(OBSTACLE_TYPES, weights=obstacle_weights(self.rules, self.score[game]))[0]
+        width, height = Obstacle.random_size(obstacle_type, rng)
+        slot = self.obstacle_count[game] % self.obstacle_slots
+        self.obstacle_x[game, slot] = WIDTH
+        self.obstacle_w[game, slot] = width
+        self.obstacle_h[game, slot] = height
+        self.obstacle_type[game, slot] = OBSTACLE_TYPES.index(obstacle_type)
+        self.obstacle_active[game, slot] = True
+        self.obstacle_count[game] += 1
+
+    def _spawn_slope(self, game):
+        slope_type = self.rngs[game].choice(["up", "down"])
+        slot = self.slope_count[game] % self.slope_slots
+        self.slope_x[game, slot] = WIDTH
+        self.slope_up[game, slot] = slope_type == "up"
+        self.slope_active[game, slot] = True
+        self.slope_seq[game, slot] = self.slope_count[game]
+        self.slope_count[game] += 1
+
+    def reflex_inputs(self, lookahead=REFLEX_LOOKAHEAD):
+        """bike_game.reflex_policy と同じ判定をまとめて行う"""
+        front = (self.bike_x + self.bike_w)[None, :, None]
+        distance = self.obstacle_x[:, None, :] - front
+        ahead = self.obstacle_active[:, None, :] & (distance >= 0) & (distance <= lookahead)
+        return ahead.any(axis=2)
+
+    def step(self, inputs=None):
+        """全ゲームを1ティック進める（inputs は (ゲーム数, バイク数) の bool 配列）"""
+        if inputs is not None:
+            jump = inputs & ~self.jumping & ~self.crashed
+            self.velocity_y[jump] = self.jump_velocity
+            self.jumping |= jump
+
+        alive = ~self.game_over
+        if not alive.any():
+            return
+
+        # 障害物と坂の生成（タイマーは配列で進め、抽選はゲームごとに Python で行う）
+        rules = self.rules
+        self.obstacle_timer += alive
+        spawn_rate = np.maximum(rules["spawn_min"],
+                                rules["spawn_base"] - (self.score // rules["spawn_score_step"]).astype(np.int64))
+        for game in np.flatnonzero(alive & (self.obstacle_timer >= spawn_rate)):
+            self._spawn_obstacle(game)
+            self.obstacle_timer[game] = 0
+
+        self.slope_timer += alive
+        for game in np.flatnonzero(alive & (self.slope_timer >= rules["slope_interval"])):
+            if self.rngs[game].random() < rules["slope_chance"]:
+                self._spawn_slope(game)
+                self.slope_timer[game] = 0
+
+        # バイクの更新（重力と、坂を考慮した地面）
+        moving = alive[:, None] & ~self.crashed
+        velocity_y = np.where(moving, self.velocity_y + self.gravity, self.velocity_y)
+        y = np.where(moving, round_half_away(self.y + velocity_y), self.y)
+
+        relative_x = self.bike_centerx[None, :, None] - self.slope_x[:, None, :]
+        covering = self.slope_active[:, None, :] & (relative_x >= 0) & (relative_x <= Slope.WIDTH)
+        oldest = np.argmin(np.where(covering, self.slope_seq[:, None, :], np.iinfo(np.int64).max), axis=2)
+        on_slope = covering.any(axis=2)
+        relative_x = np.take_along_axis(relative_x, oldest[..., None], axis=2)[..., 0]
+        up = np.take_along_axis(np.broadcast_to(self.slope_up[:, None, :], covering.shape),
+                                oldest[..., None], axis=2)[..., 0]
+        slope_height = (relative_x / Slope.WIDTH) * Slope.HEIGHT
+        slope_top = GROUND_Y - Slope.HEIGHT
+        ground = np.where(up, (slope_top + Slope.HEIGHT) - slope_height, slope_top + slope_height) - self.bike_h
+        ground = np.where(on_slope, ground, HEIGHT - 140 - 40)
+
+        landed = moving & (y >= ground)
+        y = np.where(landed, round_half_away(ground), y)
+        velocity_y = np.where(landed, 0.0, velocity_y)
+        self.jumping &= ~landed
+
+        # 坂にめり込んでいたら押し上げる（坂は動く前の位置、矩形が重なるものだけ）
+        slope_x = self.slope_x[:, None, :]
+        slope_y = GROUND_Y - Slope.HEIGHT
+        bike_x = self.bike_x[None, :, None]
+        bike_w = self.bike_w[None, :, None]
+        touching = (moving[..., None] & self.slope_active[:, None, :]
+                    & (slope_x < bike_x + bike_w) & (bike_x < slope_x + Slope.WIDTH)
+                    & (y[..., None] < slope_y + Slope.HEIGHT) & (slope_y < y[..., None] + self.bike_h[None, :, None]))
+        for bike, depths in enumerate(self.depths):
+            if touching[:, bike].any():
+                lift = slope_lift(depths, self.bike_x[bike], self.bike_w[bike], y[:, bike, None],
+                                  self.slope_x, self.slope_up, touching[:, bike])
+                lifted = lift > 0
+                y[:, bike] -= np.where(lifted, lift, 0)
+                settle = lifted & (velocity_y[:, bike] >= 0)
+                velocity_y[:, bike] = np.where(settle, 0.0, velocity_y[:, bike])
+                self.jumping[:, bike] &= ~settle
+        self.y = y
+        self.velocity_y = velocity_y
+
+        # 障害物と坂の移動（画面外に出たものは消す）
+        self.obstacle_x -= SCROLL_SPEED * alive[:, None]
+        self.obstacle_active &= self.obstacle_x + self.obstacle_w >= 0
+        self.slope_x -= SCROLL_SPEED * alive[:, None]
+        self.slope_active &= self.slope_x + Slope.WIDTH >= 0
+
+        # 衝突判定（矩形の重なりで候補を絞り、候補だけをバイクのマスクで精密に調べる）
+        obstacle_x = self.obstacle_x[:, None, :]
+        obstacle_y = (GROUND_Y - self.obstacle_h)[:, None, :]
+        bike_y = self.y[:, :, None]
+        hit = (moving[..., None] & self.obstacle_active[:, None, :]
+               & (bike_x < obstacle_x + self.obstacle_w[:, None, :]) & (obstacle_x < bike_x + bike_w)
+               & (bike_y < obstacle_y + self.obstacle_h[:, None, :]) & (obstacle_y < bike_y + self.bike_h[None, :, None]))
+        games, bikes, slots = np.nonzero(hit)
+        if len(games):
+            left = self.obstacle_x[games, slots] - self.bike_x[bikes]
+            top = GROUND_Y - self.obstacle_h[games, slots] - self.y[games, bikes]
+            pixels = np.zeros(len(games), dtype=np.int64)
+            for bike, table in enumerate(self.summed_masks):
+                mine = bikes == bike
+                pixels[mine] = opaque_in(table, left[mine], top[mine], left[mine] + self.obstacle_w[games[mine], slots[mine]],
+                                         top[mine] + self.obstacle_h[games[mine], slots[mine]])
+            self.crashed[games[pixels > 0], bikes[pixels > 0]] = True
+
+        # 全バイクがクラッシュしたゲームは終了
+        self.game_over |= alive & self.crashed.all(axis=1)
+        self.score[alive] += 0.2
+        self.frame += alive
+
+    def run(self, max_ticks, lookahead=REFLEX_LOOKAHEAD):
+        """全ゲームが終わるか max_ticks に達するまで反射ボットで進める"""
+        for _ in range(max_ticks):
+            self.step(self.reflex_inputs(lookahead))
+            if self.game_over.all():
+                break
+        return self
+
+def verify(seeds, game_mode, max_ticks, lookahead=REFLEX_LOOKAHEAD, rules=None):
+    """Simulation（スプライト版）と結果が一致するゲームの数を返す"""
+    batch = BatchSimulation(seeds, game_mode, rules).run(max_ticks, lookahead)
+    matched = 0
+    for i, seed in enumerate(seeds):
+        sim = bike_game.Simulation(game_mode, seed, rules)
+        state = sim.get_state()
+        while not state["game_over"] and state["frame"] < max_ticks:
+            state = sim.step(bike_game.reflex_policy(state, lookahead))
+        ys = [bike["y"] for bike in state["bikes"]]
+        if (state["frame"] == batch.frame[i] and state["score"] == batch.score[i]
+                and ys == batch.y[i].tolist()):
+            matched += 1
+        else:
+            print(f"mismatch seed={seed}: sprite frame={state['frame']} y={ys}, "
+                  f"batch frame={batch.frame[i]} y={batch.y[i].tolist()}", file=sys.stderr)
+    return matched
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="NumPy バッチシミュレータ")
+    parser.add_argument("--games", type=int, default=10000, help="同時に進めるゲーム数")
+    parser.add_argument("--ticks", type=int, default=36000, help="最大ティック数")
+    parser.add_argument("--seed", type=int, default=0, help="最初のゲームのシード（以降は連番）")
+    parser.add_argument("--mode", choices=["single", "two_player"], default="single")
+    parser.add_argument("--rule", action="append", default=[], metavar="NAME=JSON",
+                        help="DEFAULT_RULES の値を上書き（例: --rule gravity=0.9 --rule spawn_min=35）")
+    parser.add_argument("--lookahead", type=int, default=REFLEX_LOOKAHEAD, help="反射ボットがジャンプする障害物までの距離")
+    parser.add_argument("--verify", type=int, default=0, metavar="K",
+                        help="最初の K ゲームをスプライト版でも実行して結果の一致を確認")
+    parser.add_argument("--output", metavar="FILE", help="ゲームごとのスコアを JSON で書き出す")
+    return parser.parse_args(argv)
+
+def parse_rules(assignments):
+    """NAME=JSON 形式の指定をルールの辞書にする"""
+    rules = {}
+    for assignment in assignments:
+        name, _, value = assignment.partition("=")
+        if name not in DEFAULT_RULES:
+            raise SystemExit(f"unknown rule: {name} (choose from {', '.join(DEFAULT_RULES)})")
+        rules[name] = json.loads(value)
+    return rules
+
+def main(argv=None):
+    args = parse_args(argv)
+    seeds = range(args.seed, args.seed + args.games)
+    rules = parse_rules(args.rule)
+
+    start = time.perf_counter()
+    batch = BatchSimulation(seeds, args.mode, rules).run(args.ticks, args.lookahead)
+    elapsed = time.perf_counter() - start
+
+    scores = batch.score.tolist()
+    game_ticks = int(batch.frame.sum())
+    print(f"{args.games} games, {game_ticks} game-ticks in {elapsed:.2f}s "
+          f"({game_ticks / elapsed:.0f} game-ticks/sec), {int(batch.game_over.sum())} finished")
+    print(f"score mean {np.mean(scores):.1f}  p10 {percentile(scores, 10):.1f}  p50 {percentile(scores, 50):.1f}  "
+          f"p90 {percentile(scores, 90):.1f}  max {max(scores):.1f}")
+
+    if args.verify:
+        verify_seeds = list(seeds)[:args.verify]
+        matched = verify(verify_seeds, args.mode, args.ticks, args.lookahead, rules)
+        print(f"verify: {matched}/{len(verify_seeds)} games match the sprite simulation")
+        if matched != len(verify_seeds):
+            sys.exit(1)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"seeds": list(seeds), "frames": batch.frame.tolist(), "scores": scores}, f)
+
+if __name__ == "__main__":
+    main()
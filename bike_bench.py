@@ -0,0 +1,247 @@
+"""バイクゲームのベンチマーク
+
+固定シード・固定フレーム数のシナリオをヘッドレスで実行し、シミュレーションのみの場合と
+オフスクリーンへの描画を含めた場合それぞれのフレームレート、フレーム時間のパーセンタイル、
+最大メモリ使用量を JSON で出力する。メモリはシナリオごとに別のプロセスで計り、tracemalloc の
+最大値（Python のオブジェクトのみ）とプロセスの最大 RSS（SDL のサーフェースのピクセルも含む）を出す。
+
+    python bike_bench.py --frames 3000 --output bench.json
+    python bike_bench.py --scenario stress --compare bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:     # Windows
+    resource = None
+
+# ウィンドウを開かずに表示形式のサーフェースを使えるようにダミードライバで初期化する
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+
+import bike_game
+from bike_game import WIDTH, HEIGHT, percentile
+
+# シナリオ名 -> 設定
+#   mode: プレイモード / score: 開始時のスコア（後半の出現率を再現）
+#   extra_bikes: 追加するバイクの台数 / obstacle_every, slope_every: 追加で障害物・坂を出すティック間隔
+#   ghosts: ゴーストレースのゴーストの台数（NumPy が必要）
+#   window: 描画先（ウィンドウ）の大きさ / quality: QualityGovernor.LEVELS の段（どちらかがあれば ScaledRenderer で描く）
+SCENARIOS = {
+    "single": {"mode": "single"},
+    "two_player": {"mode": "two_player"},
+    "late_game": {"mode": "single", "score": 320},
+    "late_game_two_player": {"mode": "two_player", "score": 320},
+    "stress": {"mode": "two_player", "extra_bikes": 30, "obstacle_every": 1, "slope_every": 2},
+    "ghosts_256": {"mode": "single", "ghosts": 256},
+    "ghosts_256_low": {"mode": "single", "ghosts": 256, "quality": 3},
+    "window_4k": {"mode": "two_player", "window": (3840, 2160)},
+    "window_4k_low": {"mode": "two_player", "window": (3840, 2160), "quality": 3},
+}
+
+def setup(game, config, seed):
+    """シナリオの初期状態を作る（ゲームオーバー後のリセットでも呼ばれる）"""
+    sim = game.sim
+    sim.reset(seed, score=config.get("score", 0))
+    for i in range(config.get("extra_bikes", 0)):
+        sim.add_bike("bike1" if i % 2 == 0 else "bike2", x=160 + i * 24)
+    if game.ghosts is not None:
+        game.ghosts.reset()
+
+def run_scenario(name, frames, seed, render, measure_memory=False):
+    """シナリオを frames フレーム実行して計測結果を返す"""
+    config = SCENARIOS[name]
+    ghosts = None
+    if config.get("ghosts"):
+        from bike_ghost import GhostPack
+        ghosts = GhostPack(config["ghosts"], seed=seed)
+    game = bike_game.Game(config["mode"], ghosts=ghosts)
+    # ベンチマーク中はプロファイラの計測を無効にする
+    game.profiler = game.sim.profiler = bike_game.nullprofiler
+    if "window" in config or "quality" in config:
+        governor = bike_game.QualityGovernor()
+        governor.level = config.get("quality", 0)
+        renderer = bike_game.ScaledRenderer(game, governor)
+    else:
+        renderer = bike_game.FullRenderer(game)
+    surface = pygame.Surface(config.get("window", (WIDTH, HEIGHT))).convert()
+    spawn_rng = random.Random(seed)
+    obstacle_every = config.get("obstacle_every", 0)
+    slope_every = config.get("slope_every", 0)
+
+    game_seed = seed
+    setup(game, config, game_seed)
+    state = game.sim.get_state()
+    frame_times = []
+    max_obstacles = 0
+    games = 1
+
+    if measure_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    for frame in range(frames):
+        t = time.perf_counter()
+        sim = game.sim
+        if obstacle_every and frame % obstacle_every == 0:
+            obstacle_type = spawn_rng.choice(["block", "spike", "wall"])
+            sim.spawn_obstacle(obstacle_type, *bike_game.Obstacle.random_size(obstacle_type, spawn_rng))
+        if slope_every and frame % slope_every == 0:
+            sim.spawn_slope(spawn_rng.choice(["up", "down"]))
+        tick = sim.frame
+        # 以前の結果と比べられるよう、ボットの距離は既定値ではなく固定の 90 にする
+        state = sim.step(bike_game.reflex_policy(state, 90))
+        if ghosts is not None:
+            ghosts.step(sim, tick)
+        if render:
+            renderer.draw(surface)
+        if state["game_over"]:
+            game_seed += 1
+            games += 1
+            setup(game, config, game_seed)
+            state = sim.get_state()
+        frame_times.append((time.perf_counter() - t) * 1000)
+        max_obstacles = max(max_obstacles, len(sim.obstacles) + len(sim.slopes))
+    elapsed = time.perf_counter() - start
+
+    peak_traced_kb = None
+    if measure_memory:
+        peak_traced_kb = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+
+    return {
+        "scenario": name,
+        "mode": "sim+render" if render else "sim",
+        "frames": frames,
+        "seed": seed,
+        "games": games,
+        "fps": frames / elapsed if elapsed > 0 else float("inf"),
+        "frame_ms": {
+            "mean": elapsed * 1000 / frames,
+            "p50": percentile(frame_times, 50),
+            "p90": percentile(frame_times, 90),
+            "p99": percentile(frame_times, 99),
+            "max": max(frame_times),
+        },
+        "max_bikes": len(game.sim.bikes),
+        "max_obstacles_and_slopes": max_obstacles,
+        # 衝突の精密判定（マスク）を行った回数と、矩形での大まかな判定で省けた回数
+        "narrow_checks": game.sim.narrow_checks,
+        "narrow_avoided": game.sim.narrow_avoided,
+        "peak_traced_kb": peak_traced_kb,
+    }
+
+def peak_rss_kb():
+    """プロセスの最大 RSS（KB、resource が使えない環境では None）"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS はバイト単位、Linux は KB 単位
+    return rss / 1024 if sys.platform == "darwin" else rss
+
+def measure_memory(name, frames, seed, render):
+    """シナリオを別のプロセスで実行し、メモリ使用量を返す
+
+    peak_traced_kb は tracemalloc の最大値で、Python のオブジェクトしか数えない。
+    peak_rss_kb はプロセスの最大 RSS で、SDL のサーフェースのピクセルとインタープリタ・pygame 自体の分も含む。
+    """
+    command = [sys.executable, os.path.abspath(__file__), "--memory-child", name,
+               "--frames", str(frames), "--seed", str(seed)]
+    if not render:
+        command.append("--sim-only")
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    # pygame の起動メッセージの後の最後の行が結果
+    return json.loads(output.splitlines()[-1])
+
+def memory_child(args):
+    """measure_memory から起動されたプロセスでの計測（結果の JSON を標準出力に書く）"""
+    render = not args.sim_only
+    # RSS は tracemalloc 自体が使うメモリを含めないよう、先に計測なしで実行して取る
+    run_scenario(args.memory_child, args.frames, args.seed, render)
+    rss_kb = peak_rss_kb()
+    traced_kb = run_scenario(args.memory_child, args.frames, args.seed, render,
+                             measure_memory=True)["peak_traced_kb"]
+    json.dump({"peak_traced_kb": traced_kb, "peak_rss_kb": rss_kb}, sys.stdout)
+
+def environment():
+    """比較のための実行環境の情報"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "pygame": pygame.version.ver,
+        "sdl": ".".join(map(str, pygame.get_sdl_version())),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+    }
+
+def compare(base, results):
+    """以前の結果と比べたフレームレートの比を表示"""
+    previous = {(r["scenario"], r["mode"]): r for r in base["results"]}
+    print(f"{'scenario':<22}{'mode':<12}{'fps':>10}{'base fps':>10}{'ratio':>8}{'p99 ms':>9}{'base p99':>9}")
+    for result in results:
+        old = previous.get((result["scenario"], result["mode"]))
+        if old is None:
+            continue
+        print(f"{result['scenario']:<22}{result['mode']:<12}{result['fps']:>10.0f}{old['fps']:>10.0f}"
+              f"{result['fps'] / old['fps']:>8.2f}{result['frame_ms']['p99']:>9.3f}{old['frame_ms']['p99']:>9.3f}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="バイクゲームのベンチマーク")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="実行するシナリオ（複数指定可、省略時はすべて）")
+    parser.add_argument("--frames", type=int, default=2000, help="シナリオごとのフレーム数")
+    parser.add_argument("--seed", type=int, default=1, help="乱数シード")
+    parser.add_argument("--sim-only", action="store_true", help="描画を含む計測を行わない")
+    parser.add_argument("--no-memory", action="store_true", help="メモリ使用量の計測（別プロセスでの再実行）を省く")
+    parser.add_argument("--output", metavar="FILE", help="結果の JSON を書き出すファイル（省略時は標準出力）")
+    parser.add_argument("--compare", metavar="FILE", help="以前の結果の JSON と比較して表示")
+    # measure_memory が起動するプロセス用（1つのシナリオのメモリだけを計る）
+    parser.add_argument("--memory-child", choices=sorted(SCENARIOS), help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    bike_game.get_screen()
+    if args.memory_child:
+        memory_child(args)
+        return
+
+    results = []
+    for name in args.scenario or SCENARIOS:
+        for render in ([False] if args.sim_only else [False, True]):
+            result = run_scenario(name, args.frames, args.seed, render)
+            if not args.no_memory:
+                # メモリは時間の計測とは別に、前のシナリオの影響を受けないよう別のプロセスで計る
+                result.update(measure_memory(name, args.frames, args.seed, render))
+            results.append(result)
+            print(f"{name:<22}{result['mode']:<12}{result['fps']:>10.0f} fps  "
+                  f"p50 {result['frame_ms']['p50']:.3f} ms  p99 {result['frame_ms']['p99']:.3f} ms",
+                  file=sys.stderr)
+
+    report = {"environment": environment(), "frames": args.frames, "seed": args.seed, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+if __name__ == "__main__":
+    main()
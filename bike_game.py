@@ -1,15 +1,52 @@
-import pygame
-import sys
-import random
+import argparse
+import bisect
+import collections
+import csv
+import gc
+import json
+import math
 import os
+import random
+import struct
+import sys
+import time
+import zlib
+from array import array
+
+# 起動時間計測の基準（プロセス起動からの経過ではなくモジュール読み込み開始時点）
+_LAUNCH_TIME = time.perf_counter()
 
-# Pygameの初期化
-pygame.init()
+import pygame
 
-# 画面設定
+# 画面設定（ウィンドウは描画が必要になった時点で get_screen() が作成する）
 WIDTH, HEIGHT = 1200, 800
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("バイクゲーム")
+screen = None
+
+# 障害物と坂が流れる速さ（1ティックあたりのピクセル数）
+SCROLL_SPEED = 6
+
+# シミュレーションの更新頻度（固定タイムステップ）。物理の定数はすべて1ティックあたりの値
+SIM_HZ = 60
+SIM_DT = 1.0 / SIM_HZ
+# 処理落ちしたときに1フレームで追いつく時間の上限（これを超えた分はゲームが遅れる）
+MAX_FRAME_TIME = 0.25
+
+# 難易度のルール（Simulation(rules=...) やバランス調整のスイープで一部を上書きできる）
+DEFAULT_RULES = {
+    "spawn_base": 100,          # 障害物の生成間隔の初期値（ティック）
+    "spawn_min": 40,            # 生成間隔の下限
+    "spawn_score_step": 50,     # スコアがこれだけ増えるごとに生成間隔が1ティック縮む
+    # 障害物 [ブロック, トゲ, 壁] の重み（壁の確率は低く保つ）と、スコアがしきい値を超えたときの重み
+    "weights": [60, 35, 5],
+    "weight_steps": [[100, [50, 40, 10]], [300, [40, 45, 15]]],
+    "slope_interval": 200,      # 坂の生成を試み始める間隔（ティック）
+    "slope_chance": 0.7,        # 坂を生成する確率（ティックごと）
+    "gravity": 0.8,
+    "jump_velocity": -18,
+}
+
+# 起動時間の計測ポイント（名前 -> 起動からの経過ミリ秒）
+startup_marks = {}
 
 # 色の定義
 WHITE = (255, 255, 255)
@@ -19,9 +56,63 @@ GREEN = (0, 255, 0)
 BLUE = (0, 0, 255)
 GRAY = (100, 100, 100)
 
-# 日本語フォントの設定
-def get_japanese_font(size):
-    """日本語をサポートするフォントを取得"""
+def mark_startup(name):
+    """起動からの経過時間を記録（同じ名前は最初の1回だけ）"""
+    if name not in startup_marks:
+        startup_marks[name] = (time.perf_counter() - _LAUNCH_TIME) * 1000
+
+def report_startup():
+    """最初のフレーム表示までの起動時間を1度だけ表示"""
+    if "first_frame" in startup_marks:
+        return
+    mark_startup("first_frame")
+    details = ", ".join(f"{name} {ms:.1f} ms" for name, ms in startup_marks.items())
+    print(f"Startup: {startup_marks['first_frame']:.1f} ms to first frame ({details})")
+
+def get_screen(vsync=False, window=None, fullscreen=False, scaled=False):
+    """表示用ウィンドウを取得（初回呼び出し時に必要なサブシステムだけ初期化）
+
+    引数はウィンドウ作成時にだけ有効。垂直同期には SCALED フラグが必要。
+    scaled なら画面は WIDTH x HEIGHT のまま SDL がウィンドウ（fullscreen なら画面全体）に拡大して表示し、
+    そうでなければ window（幅, 高さ）か画面全体の大きさのウィンドウを作る（拡大は描画側の ScaledRenderer が行う）。
+    """
+    global screen
+    if screen is None:
+        # 音声などは使わないので pygame.init() ではなく表示だけを初期化
+        pygame.display.init()
+        flags = pygame.FULLSCREEN if fullscreen else 0
+        if vsync or scaled:
+            screen = pygame.display.set_mode((WIDTH, HEIGHT), pygame.SCALED | flags, vsync=int(vsync))
+        elif fullscreen:
+            screen = pygame.display.set_mode((0, 0), flags)
+        else:
+            screen = pygame.display.set_mode(window or (WIDTH, HEIGHT))
+        pygame.display.set_caption("バイクゲーム")
+        mark_startup("display")
+    return screen
+
+# フォント解決結果のディスクキャッシュ（起動のたびにフォントを探し直さない）
+FONT_CACHE_PATH = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "pygame-bike", "font.json")
+
+_fonts = {}            # サイズ -> Font
+_font_resolved = False
+_font_path = None      # 解決済みのフォントファイル（None は pygame デフォルト）
+
+def _renders_japanese(font):
+    """フォントで日本語が描画できるかテスト"""
+    for test_text in ["あ", "バイク", "ゲーム"]:
+        try:
+            test_surface = font.render(test_text, True, (0, 0, 0))
+        except pygame.error:
+            return False
+        if test_surface.get_width() <= 0 or test_surface.get_height() <= 0:
+            return False
+    return True
+
+def _probe_font_path():
+    """日本語をサポートするフォントファイルを探す（見つからなければ None）"""
     # まず、macOSのシステムフォントファイルから直接読み込みを試行
     font_paths = [
         '/System/Library/Fonts/Hiragino Sans GB.ttc',
@@ -34,16 +125,16 @@ def get_japanese_font(size):
     for font_path in font_paths:
         try:
             if os.path.exists(font_path):
-                font = pygame.font.Font(font_path, size)
+                font = pygame.font.Font(font_path, 24)
                 # 日本語テスト
                 test_surface = font.render("バイクゲーム", True, (0, 0, 0))
                 if test_surface.get_width() > 0:
-                    return font
+                    return font_path
         except Exception as e:
             print(f"Font file {font_path} failed: {e}")
             continue
     
-    # macOS用の確実な日本語フォント候補
+    # macOS用の確実な日本語フォント候補（システムフォント名からファイルを解決）
     font_candidates = [
         'AppleGothic',          # macOS標準日本語フォント
         'HiraginoSans-W3',      # macOS Hiragino Sans
@@ -52,78 +143,289 @@ def get_japanese_font(size):
         'Arial Unicode MS',     # macOS Arial Unicode
         'Helvetica',            # macOS標準フォント
         'System Font',          # システムフォント
-        None                    # pygame デフォルト
     ]
     
     for font_name in font_candidates:
         try:
-            if font_name:
-                font = pygame.font.SysFont(font_name, size)
-            else:
-                font = pygame.font.Font(None, size)
-            
-            # より確実な日本語文字テスト
-            test_texts = ["あ", "バイク", "ゲーム"]
-            all_valid = True
-            
-            for test_text in test_texts:
-                try:
-                    test_surface = font.render(test_text, True, (0, 0, 0))
-                    if test_surface.get_width() <= 0 or test_surface.get_height() <= 0:
-                        all_valid = False
-                        break
-                except:
-                    all_valid = False
-                    break
-            
-            if all_valid:
-                print(f"Using font: {font_name if font_name else 'Default pygame font'}")
-                return font
-                
+            font_path = pygame.font.match_font(font_name)
+            if font_path and _renders_japanese(pygame.font.Font(font_path, 24)):
+                print(f"Using font: {font_name}")
+                return font_path
         except Exception as e:
             print(f"Font {font_name} failed: {e}")
             continue
     
-    # 最終手段：強制的にデフォルトフォントを使用
-    print("Warning: No suitable Japanese font found, using default")
-    return pygame.font.Font(None, size)
+    # 最終手段：pygame デフォルトフォントを使用
+    print("Using font: Default pygame font")
+    return None
+
+def _load_font_cache():
+    """ディスクキャッシュからフォントパスを読み込む（無効なら False）"""
+    try:
+        with open(FONT_CACHE_PATH, encoding="utf-8") as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return False
+    font_path = cached.get("path")
+    if font_path is not None and not os.path.exists(font_path):
+        return False
+    return cached
+
+def _save_font_cache(font_path):
+    try:
+        os.makedirs(os.path.dirname(FONT_CACHE_PATH), exist_ok=True)
+        with open(FONT_CACHE_PATH, "w", encoding="utf-8") as f:
+            json.dump({"path": font_path}, f, ensure_ascii=False)
+    except OSError as e:
+        print(f"Warning: Could not write font cache: {e}")
+
+def resolve_font_path():
+    """日本語フォントのファイルパスを取得（メモリ → ディスク → 探索の順）"""
+    global _font_resolved, _font_path
+    if not _font_resolved:
+        cached = _load_font_cache()
+        if cached:
+            _font_path = cached.get("path")
+        else:
+            _font_path = _probe_font_path()
+            _save_font_cache(_font_path)
+        _font_resolved = True
+    return _font_path
+
+# 日本語フォントの設定
+def get_japanese_font(size):
+    """日本語をサポートするフォントを取得（サイズごとに1つだけ生成）"""
+    font = _fonts.get(size)
+    if font is not None:
+        return font
+
+    if not pygame.font.get_init():
+        pygame.font.init()
+
+    font_path = resolve_font_path()
+    try:
+        font = pygame.font.Font(font_path, size)
+    except (OSError, pygame.error) as e:
+        # キャッシュされたフォントが読めない場合はデフォルトフォントを使用
+        print(f"Warning: Could not load font {font_path}: {e}")
+        font = pygame.font.Font(None, size)
+    _fonts[size] = font
+    return font
+
+# テキスト描画のキャッシュ
+class TextCache:
+    """文字列や色が変わったときだけ再描画するテキストサーフェースのキャッシュ
+
+    Font.render と同じ引数で呼べるので、フォントの代わりにそのまま使える。
+    """
+    total_renders = 0  # すべてのキャッシュで実際に描画した回数（プロファイラ用）
+
+    def __init__(self, font, max_entries=128):
+        self.font = font
+        self.max_entries = max_entries
+        self.renders = 0
+        self._surfaces = {}
+
+    def render(self, text, antialias, color):
+        key = (text, antialias, color)
+        surface = self._surfaces.get(key)
+        if surface is None:
+            # スコア表示などで無限に増えないよう上限を超えたら捨てる
+            if len(self._surfaces) >= self.max_entries:
+                self._surfaces.clear()
+            surface = self.font.render(text, antialias, color)
+            self._surfaces[key] = surface
+            self.renders += 1
+            TextCache.total_renders += 1
+        return surface
+
+# 画像アセットの管理
+ASSET_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class AssetCache:
+    """画像を1度だけ読み込み、使用するすべての派生画像（拡大縮小・反転・クラッシュ時の色）を事前に作っておく"""
+    # バイクの種類 -> (画像ファイル, 左右反転するか, 読み込めない場合の代替色)
+    BIKE_FILES = {
+        "bike1": ("bike.png", False, BLUE),
+        "bike2": ("bike2.png", True, GREEN),
+    }
+    GHOST_ALPHA = 90  # ゴースト（bike_ghost.py）の不透明度
+
+    def __init__(self):
+        self._sources = {}
+        self._images = {}
+        self._converted = False
+
+    def get(self, name):
+        """名前から画像を取得（ウィンドウ作成後は表示形式に変換済みのものを返す）"""
+        display_ready = pygame.display.get_init() and pygame.display.get_surface() is not None
+        if not self._images or (display_ready and not self._converted):
+            self._build(display_ready)
+        return self._images[name]
+
+    def _load_source(self, bike_type):
+        """元画像をディスクから読み込む（プロセス中1回だけ）"""
+        if bike_type not in self._sources:
+            filename = self.BIKE_FILES[bike_type][0]
+            try:
+                # 起動したディレクトリに関係なくこのファイルと同じ場所から読み込む
+                self._sources[bike_type] = pygame.image.load(os.path.join(ASSET_DIR, filename))
+            except (pygame.error, FileNotFoundError):
+                print(f"Warning: Could not load {filename}. Using default.")
+                self._sources[bike_type] = None
+        return self._sources[bike_type]
+
+    def _build(self, convert):
+        images = {}
+        for bike_type, (_, flip, color) in self.BIKE_FILES.items():
+            source = self._load_source(bike_type)
+            if source is None:
+                # 画像が読み込めない場合は四角形で代用
+                for suffix, size in (("", (60, 40)), ("_select", (160, 100)), ("_small", (80, 50))):
+                    image = pygame.Surface(size)
+                    image.fill(color)
+                    images[bike_type + suffix] = image
+                images[bike_type + "_crashed"] = images[bike_type]
+                ghost = images[bike_type].copy()
+                ghost.set_alpha(self.GHOST_ALPHA)
+                images[bike_type + "_ghost"] = images[bike_type + "_crashed_ghost"] = ghost
+                continue
+
+            if convert:
+                source = source.convert_alpha()
+            if flip:
+                source = pygame.transform.flip(source, True, False)
+            # ゲーム中のサイズと選択画面のサイズ
+            image = pygame.transform.scale(source, (80, 50))
+            images[bike_type] = image
+            images[bike_type + "_small"] = image
+            images[bike_type + "_select"] = pygame.transform.scale(source, (160, 100))
+            # クラッシュ時の視覚効果（赤くする）
+            crashed = image.copy()
+            crashed.fill((255, 0, 0, 128), special_flags=pygame.BLEND_RGBA_MULT)
+            images[bike_type + "_crashed"] = crashed
+            # ゴースト用の半透明の画像
+            for name, base in ((bike_type + "_ghost", image), (bike_type + "_crashed_ghost", crashed)):
+                ghost = base.copy()
+                ghost.fill((255, 255, 255, self.GHOST_ALPHA), special_flags=pygame.BLEND_RGBA_MULT)
+                images[name] = ghost
+
+        self._images = images
+        self._converted = convert
+
+assets = AssetCache()
+
+# 衝突判定用のマスクのキャッシュ
+class MaskCache:
+    """画像ごとの衝突判定用マスクと、そこから求めた列ごとの輪郭を1度だけ作ってキャッシュする
+
+    画像はアセットキャッシュとテクスチャアトラスで共有されているので、画像そのものをキーにする。
+    """
+    def __init__(self):
+        self._masks = {}
+        self._bottoms = {}
+        self._tops = {}
+        self._clearances = {}
+        self.built = 0
+
+    def get(self, image):
+        mask = self._masks.get(image)
+        if mask is None:
+            mask = self._masks[image] = pygame.mask.from_surface(image)
+            self.built += 1
+        return mask
+
+    def bottom_profile(self, image):
+        """列ごとの最も下の不透明なピクセルの行（不透明なピクセルがない列は -1）"""
+        profile = self._bottoms.get(image)
+        if profile is None:
+            mask = self.get(image)
+            width, height = mask.get_size()
+            profile = self._bottoms[image] = [
+                max((row for row in range(height) if mask.get_at((column, row))), default=-1)
+                for column in range(width)
+            ]
+        return profile
+
+    def top_profile(self, image):
+        """列ごとの最も上の不透明なピクセルの行（不透明なピクセルがない列は画像の高さ）"""
+        profile = self._tops.get(image)
+        if profile is None:
+            mask = self.get(image)
+            width, height = mask.get_size()
+            profile = self._tops[image] = [
+                min((row for row in range(height) if mask.get_at((column, row))), default=height)
+                for column in range(width)
+            ]
+        return profile
+
+    def clearance(self, lower, upper):
+        """upper の上に lower を置いたときのめり込みの表
+
+        lower を upper から横に offset ずらしたときの「lower の最も下のピクセル - upper の表面」の列ごとの最大値を
+        offset + lower の幅 - 1 の位置に持つ（重なる列に不透明なピクセルがなければ None）。
+        lower の上端が upper の上端より dy 下にあるとき、dy + 値 + 1 だけ持ち上げればめり込まない。
+        """
+        key = (lower, upper)
+        table = self._clearances.get(key)
+        if table is None:
+            bottom = self.bottom_profile(lower)
+            top = self.top_profile(upper)
+            table = self._clearances[key] = []
+            for offset in range(1 - len(bottom), len(top)):
+                depths = [bottom[column] - top[column + offset]
+                          for column in range(max(0, -offset), min(len(bottom), len(top) - offset))
+                          if bottom[column] >= 0]
+                table.append(max(depths, default=None))
+        return table
+
+    def warm(self):
+        """バイク・障害物・坂のすべての画像のマスクと、バイクと坂のめり込みの表を事前に作る"""
+        for bike_type in AssetCache.BIKE_FILES:
+            self.get(assets.get(bike_type + "_crashed"))
+        for image in textures.images():
+            self.get(image)
+        for bike_type in AssetCache.BIKE_FILES:
+            for slope_type in ("up", "down"):
+                self.clearance(assets.get(bike_type), textures.get(slope_type, Slope.WIDTH, Slope.HEIGHT))
+
+masks = MaskCache()
 
 # バイクのクラス
-class Bike(pygame.sprite.Sprite):
+class Bike(pygame.sprite.DirtySprite):
     def __init__(self, bike_type="bike1", player_id=1):
         super().__init__()
+        self.bike_type = bike_type
         self.player_id = player_id
         self.crashed = False
         
-        # バイク画像の読み込み
-        try:
-            if bike_type == "bike1":
-                self.original_image = pygame.image.load("bike.png")
-            else:
-                self.original_image = pygame.image.load("bike2.png")
-                # bike2の画像を左右反転
-                self.original_image = pygame.transform.flip(self.original_image, True, False)
-            # 適切なサイズにスケール
-            self.original_image = pygame.transform.scale(self.original_image, (80, 50))
-            self.image = self.original_image
-        except pygame.error:
-            # 画像が読み込めない場合は四角形で代用
-            self.image = pygame.Surface((60, 40))
-            self.image.fill(BLUE if player_id == 1 else GREEN)
-            print(f"Warning: Could not load {bike_type} image. Using default.")
+        # バイク画像はアセットキャッシュから取得（ディスク読み込みや拡大縮小はしない）
+        self.original_image = assets.get(bike_type)
+        self.crashed_image = assets.get(bike_type + "_crashed")
+        self.image = self.original_image
         
         self.rect = self.image.get_rect()
         # プレイヤー1は左側、プレイヤー2は右側に配置
         self.rect.x = 80 if player_id == 1 else 120
         self.rect.y = HEIGHT - 140 - 40  # 地面位置に合わせて調整
+        self.prev_y = self.rect.y
         self.velocity_y = 0
         self.jumping = False
-        self.gravity = 0.8
+        self.gravity = DEFAULT_RULES["gravity"]
+        self.jump_velocity = DEFAULT_RULES["jump_velocity"]
         self.ground_y = HEIGHT - 140 - 40  # 地面位置に合わせて調整
 
-    def update(self, slopes=None):
+    def update(self, slopes=None, course=None):
+        """1フレーム進める（slopes は坂の ScrollIndex、course は地面の高さマップを持つ Course）
+
+        course の列は slopes のスクロール量から求めるので、course を渡すときは slopes も必要。
+        戻り値は坂との精密判定（マスクの輪郭による判定）を行った回数。
+        """
+        if course is not None and slopes is None:
+            raise ValueError("Bike.update needs slopes (the slope ScrollIndex) when course is given")
+        previous_y = self.prev_y = self.rect.y
         if self.crashed:
-            return
+            return 0
             
         # 重力の適用
         self.velocity_y += self.gravity
@@ -131,12 +433,11 @@ class Bike(pygame.sprite.Sprite):
 
         # 坂を考慮した地面の高さを計算
         current_ground_y = self.ground_y
-        if slopes:
-            for slope in slopes:
-                # バイクが坂の範囲内にいるかチェック
-                if (slope.rect.x <= self.rect.centerx <= slope.rect.right):
-                    current_ground_y = slope.get_ground_height_at_x(self.rect.centerx) - self.rect.height
-                    break
+        if course is not None:
+            # バイクの真下の列の高さをコースの高さマップから引く（索引と同じワールド座標、坂のない列は NaN）
+            surface = course.surface(self.rect.centerx + slopes.scroll)
+            if not math.isnan(surface):
+                current_ground_y = surface - self.rect.height
 
         # 地面との衝突判定
         if self.rect.y >= current_ground_y:
@@ -144,147 +445,392 @@ class Bike(pygame.sprite.Sprite):
             self.velocity_y = 0
             self.jumping = False
 
+        checks = self._rest_on_slopes(slopes) if slopes else 0
+
+        # 動いたときだけ差分描画の対象にする
+        if self.rect.y != previous_y:
+            self.dirty = 1
+        return checks
+
+    def _rest_on_slopes(self, slopes):
+        """坂を固体として扱い、バイクの不透明なピクセルが坂にめり込んでいたら押し上げる
+
+        矩形が重なる坂だけについて、バイクの列ごとの最も下のピクセルと坂の列ごとの表面を比べる
+        （MaskCache.clearance の表を引く）。精密判定を行った坂の数を返す。
+        """
+        checks = 0
+        lift = 0
+        rect = self.rect
+        for slope in slopes.overlapping(rect.left, rect.right):
+            if not rect.colliderect(slope.rect):
+                continue
+            checks += 1
+            depth = masks.clearance(self.original_image, slope.image)[rect.x - slope.rect.x + rect.width - 1]
+            if depth is not None:
+                lift = max(lift, rect.y - slope.rect.y + depth + 1)
+        if lift > 0:
+            rect.y -= lift
+            # 落ちている途中なら坂の上に着地する（上昇中はそのままジャンプを続ける）
+            if self.velocity_y >= 0:
+                self.velocity_y = 0
+                self.jumping = False
+        return checks
+
+    def interpolated_pos(self, alpha):
+        """前のティックと現在のティックの間を alpha で補間した描画位置"""
+        return (self.rect.x, round(self.prev_y + (self.rect.y - self.prev_y) * alpha))
+
     def jump(self):
         if not self.jumping and not self.crashed:
-            self.velocity_y = -18
+            self.velocity_y = self.jump_velocity
             self.jumping = True
     
     def crash(self):
         self.crashed = True
-        # クラッシュ時の視覚効果（赤くする）
-        if hasattr(self, 'original_image'):
-            self.image = self.original_image.copy()
-            self.image.fill((255, 0, 0, 128), special_flags=pygame.BLEND_RGBA_MULT)
+        # クラッシュ時の視覚効果（赤くした画像に差し替え）
+        self.image = self.crashed_image
+        self.dirty = 1
+
+    def save_state(self):
+        """ロールバック用に状態を保存する"""
+        return (self.rect.y, self.prev_y, self.velocity_y, self.jumping, self.crashed)
+
+    def load_state(self, state):
+        self.rect.y, self.prev_y, self.velocity_y, self.jumping, self.crashed = state
+        self.image = self.crashed_image if self.crashed else self.original_image
+        self.dirty = 1
+
+# 障害物・坂のテクスチャアトラス
+class TextureAtlas:
+    """障害物と坂のテクスチャを (種類, 幅, 高さ) ごとにキャッシュする
+
+    単色のブロックは最大サイズのシートを1枚だけ描画し、各サイズはその左上を切り出した
+    サブサーフェースとして共有する。模様のある壁・トゲ・坂はサイズごとに1度だけ描画する。
+    """
+    BLOCK_SHEET_SIZE = (50, 80)
+
+    def __init__(self):
+        self._block_sheet = None
+        self._textures = {}
+        self._converted = False
+        self.allocations = 0
+
+    def get(self, kind, width, height):
+        """テクスチャを取得（ウィンドウ作成後は表示形式に変換済みのものを返す）"""
+        if not self._converted and pygame.display.get_init() and pygame.display.get_surface() is not None:
+            self._block_sheet = None
+            self._textures.clear()
+            self._converted = True
+
+        key = (kind, width, height)
+        texture = self._textures.get(key)
+        if texture is None:
+            if kind == "block":
+                if self._block_sheet is None:
+                    self._block_sheet = self._draw(kind, *self.BLOCK_SHEET_SIZE)
+                texture = self._block_sheet.subsurface((0, 0, width, height))
+                self.allocations += 1
+            else:
+                texture = self._draw(kind, width, height)
+            self._textures[key] = texture
+        return texture
+
+    def warm(self):
+        """使用するすべてのサイズを事前に用意して、ゲーム中に描画が走らないようにする"""
+        for width in range(Obstacle.BLOCK_WIDTH[0], Obstacle.BLOCK_WIDTH[1] + 1):
+            for height in range(Obstacle.BLOCK_HEIGHT[0], Obstacle.BLOCK_HEIGHT[1] + 1):
+                self.get("block", width, height)
+        for height in range(Obstacle.WALL_HEIGHT[0], Obstacle.WALL_HEIGHT[1] + 1):
+            self.get("wall", Obstacle.WALL_WIDTH, height)
+        self.get("spike", *Obstacle.SPIKE_SIZE)
+        self.get("up", Slope.WIDTH, Slope.HEIGHT)
+        self.get("down", Slope.WIDTH, Slope.HEIGHT)
+
+    def images(self):
+        """用意済みのすべてのテクスチャ"""
+        return list(self._textures.values())
+
+    def _draw(self, kind, width, height):
+        self.allocations += 1
+
+        if kind in ("up", "down"):
+            image = pygame.Surface((width, height), pygame.SRCALPHA)
+            if kind == "up":
+                # 上り坂（左が低く、右が高い）
+                points = [(0, height), (width, 0), (width, height)]
+            else:
+                # 下り坂（左が高く、右が低い）
+                points = [(0, 0), (width, height), (0, height)]
+            pygame.draw.polygon(image, (101, 67, 33), points)  # 茶色
+            pygame.draw.polygon(image, (139, 115, 85), points, 3)  # 境界線
+            return image.convert_alpha() if self._converted else image
+
+        image = pygame.Surface((width, height))
+        if kind == "block":
+            # 通常のブロック障害物
+            image.fill(RED)
+        elif kind == "spike":
+            # トゲトゲの障害物（危険度高）
+            image.fill((150, 0, 0))  # 暗い赤
+            # トゲトゲのパターンを描画
+            for i in range(0, width, 6):
+                pygame.draw.polygon(image, (200, 0, 0), 
+                                  [(i, height), (i+3, height-15), (i+6, height)])
+        elif kind == "wall":
+            # 高い壁（ジャンプ必須）
+            image.fill((80, 40, 0))  # 茶色
+            # レンガのパターンを描画
+            for y in range(0, height, 20):
+                for x in range(0, width, 10):
+                    if (y // 20) % 2 == 0:
+                        pygame.draw.rect(image, (100, 60, 20), 
+                                       (x, y, 9, 19), 1)
+                    else:
+                        pygame.draw.rect(image, (100, 60, 20), 
+                                       (x-5, y, 9, 19), 1)
+        return image.convert() if self._converted else image
+
+textures = TextureAtlas()
+
+_assets_frozen = False
+
+def prepare_assets():
+    """ウィンドウ作成後に表示形式のテクスチャとマスクを用意し、初回だけ GC の走査対象から外す
+
+    ゲームを作る前に1度だけ呼ぶ。ゲームごとに固めると、リスタート前のゲームが循環参照ごと
+    永久世代に残って回収されなくなる。
+    """
+    global _assets_frozen
+    textures.warm()
+    masks.warm()
+    if not _assets_frozen:
+        # 準備で作ったオブジェクトを GC の走査対象から外し、フレーム中の GC 停止を短くする
+        gc.collect()
+        gc.freeze()
+        _assets_frozen = True
+
+# スプライトのプール
+class SpritePool:
+    """画面外に出たスプライトを捨てずに再利用するプール"""
+    def __init__(self, factory, size=0):
+        self.factory = factory
+        self._free = [factory() for _ in range(size)]
+        self.created = size
+
+    def acquire(self, *args):
+        """プールからスプライトを取り出し、reset(*args) で初期化して返す"""
+        sprite = self.take()
+        sprite.reset(*args)
+        return sprite
+
+    def take(self):
+        """プールからスプライトを初期化せずに取り出す（呼び出し側で状態を設定する）"""
+        if self._free:
+            sprite = self._free.pop()
+        else:
+            sprite = self.factory()
+            self.created += 1
+        sprite.pool = self
+        return sprite
+
+    def release(self, sprite):
+        sprite.kill()
+        sprite.pool = None
+        self._free.append(sprite)
+
+    def release_all(self, group):
+        for sprite in group.sprites():
+            self.release(sprite)
+
+# スクロール順の空間インデックス
+class ScrollIndex:
+    """x 座標順に並んだスクロールするスプライトの索引
+
+    障害物や坂はすべて同じ速さで流れ、画面右端から出現するので、出現順がそのまま x 座標順になる。
+    位置はスクロール量を足したワールド座標で保持するので、毎フレーム並べ直す必要はなく、
+    「この x 範囲と重なるもの」を二分探索で引ける（地面の高さはコースの高さマップで引く）。
+    """
+    def __init__(self):
+        self.scroll = 0
+        self._lefts = []
+        self._rights = []
+        self._items = []
+        self._start = 0
+        self._max_width = 0
+
+    def __len__(self):
+        return len(self._items) - self._start
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def add(self, sprite):
+        """右端から出現したスプライトを登録"""
+        self._lefts.append(sprite.rect.left + self.scroll)
+        self._rights.append(sprite.rect.right + self.scroll)
+        self._items.append(sprite)
+        self._max_width = max(self._max_width, sprite.rect.width)
+
+    def advance(self, distance):
+        """スクロールを進め、画面左端から出たものを取り除く"""
+        self.scroll += distance
+        start = self._start
+        rights = self._rights
+        while start < len(rights) and rights[start] < self.scroll:
+            start += 1
+        # 先頭の空きが増えたらまとめて詰める
+        if start > 32 and start * 2 > len(rights):
+            del self._lefts[:start], self._rights[:start], self._items[:start]
+            start = 0
+        self._start = start
+
+    def _candidates(self, world_left, world_right):
+        """ワールド座標の範囲に左端が入りうるインデックスの範囲"""
+        lo = bisect.bisect_left(self._lefts, world_left - self._max_width, self._start)
+        hi = bisect.bisect_right(self._lefts, world_right, lo)
+        return lo, hi
+
+    def overlapping(self, left, right):
+        """画面上の x 範囲 [left, right) と重なるものを出現順に返す"""
+        world_left = left + self.scroll
+        world_right = right + self.scroll
+        lo, hi = self._candidates(world_left, world_right - 1)
+        return [self._items[i] for i in range(lo, hi) if self._rights[i] > world_left]
+
+# スクロールするスプライトの基本クラス
+class ScrollingSprite(pygame.sprite.DirtySprite):
+    def __init__(self):
+        super().__init__()
+        self.speed = SCROLL_SPEED
+        self.dirty = 2  # 毎フレーム移動するので常に再描画
+        self.pool = None
+        self.rect = pygame.Rect(0, 0, 0, 0)
+
+    def interpolated_pos(self, alpha):
+        """前のティックと現在のティックの間を alpha で補間した描画位置"""
+        return (self.rect.x + round(self.speed * (1 - alpha)), self.rect.y)
+
+    def update(self):
+        self.rect.x -= self.speed
+        if self.rect.right < 0:
+            # プールから取り出したものはプールに戻す
+            if self.pool is not None:
+                self.pool.release(self)
+            else:
+                self.kill()
 
 # 坂のクラス
-class Slope(pygame.sprite.Sprite):
+class Slope(ScrollingSprite):
+    WIDTH = 150
+    HEIGHT = 80
+
     def __init__(self, slope_type="up"):
         super().__init__()
+        self.reset(slope_type)
+
+    def reset(self, slope_type):
+        """坂を画面右端に配置し直す（プールからの再利用時にも呼ばれる）"""
         self.slope_type = slope_type
-        self.speed = 6
-        self.width = 150
-        self.height = 80
-        
-        # 坂のサーフェースを作成
-        self.image = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
+        self.width = self.WIDTH
+        self.height = self.HEIGHT
         
-        if slope_type == "up":
-            # 上り坂（左が低く、右が高い）
-            points = [(0, self.height), (self.width, 0), (self.width, self.height)]
-            pygame.draw.polygon(self.image, (101, 67, 33), points)  # 茶色
-            pygame.draw.polygon(self.image, (139, 115, 85), points, 3)  # 境界線
-        elif slope_type == "down":
-            # 下り坂（左が高く、右が低い）
-            points = [(0, 0), (self.width, self.height), (0, self.height)]
-            pygame.draw.polygon(self.image, (101, 67, 33), points)  # 茶色
-            pygame.draw.polygon(self.image, (139, 115, 85), points, 3)  # 境界線
+        # 坂のサーフェースはアトラスから取得
+        self.image = textures.get(slope_type, self.width, self.height)
         
-        self.rect = self.image.get_rect()
+        self.rect.size = (self.width, self.height)
         self.rect.x = WIDTH
         self.rect.y = HEIGHT - 140 - self.height
-        
-    def update(self):
-        self.rect.x -= self.speed
-        if self.rect.right < 0:
-            self.kill()
     
-    def get_ground_height_at_x(self, x):
-        """指定されたx座標での坂の地面の高さを取得"""
-        relative_x = x - self.rect.x
-        if relative_x < 0 or relative_x > self.width:
-            return HEIGHT - 140  # 坂の範囲外は通常の地面の高さ
-        
-        if self.slope_type == "up":
+    def save_state(self):
+        """ロールバック用に状態を保存する"""
+        return (self.slope_type, self.rect.x)
+
+    def load_state(self, state):
+        slope_type, x = state
+        self.reset(slope_type)
+        self.rect.x = x
+
+    @classmethod
+    def surface_height(cls, slope_type, relative_x):
+        """坂の左端から relative_x（0 〜 WIDTH）の位置の地面の高さ（コースの高さマップにも使う）"""
+        top = HEIGHT - 140 - cls.HEIGHT
+        slope_height = (relative_x / cls.WIDTH) * cls.HEIGHT
+        if slope_type == "up":
             # 上り坂：x座標が増えるほど高くなる
-            slope_height = (relative_x / self.width) * self.height
-            return self.rect.y + self.height - slope_height
-        elif self.slope_type == "down":
-            # 下り坂：x座標が増えるほど低くなる
-            slope_height = (relative_x / self.width) * self.height
-            return self.rect.y + slope_height
+            return top + cls.HEIGHT - slope_height
+        # 下り坂：x座標が増えるほど低くなる
+        return top + slope_height
 
 # 障害物の基本クラス
-class Obstacle(pygame.sprite.Sprite):
-    def __init__(self, obstacle_type="block"):
+class Obstacle(ScrollingSprite):
+    # 種類ごとの大きさ（範囲は乱数で決まる）
+    BLOCK_WIDTH = (25, 50)
+    BLOCK_HEIGHT = (40, 80)
+    SPIKE_SIZE = (30, 60)
+    WALL_WIDTH = 20
+    WALL_HEIGHT = (100, 140)
+
+    def __init__(self, obstacle_type="block", width=None, height=None):
         super().__init__()
+        self.reset(obstacle_type, width, height)
+
+    def reset(self, obstacle_type, width=None, height=None):
+        """障害物を画面右端に配置し直す（プールからの再利用時にも呼ばれる）
+
+        大きさはコースの配置で決まっている。省略したときは random_size で決める。
+        """
         self.obstacle_type = obstacle_type
-        self.speed = 6
-        
+        if width is None:
+            width, height = self.random_size(obstacle_type, random)
+        self.width = width
+        self.height = height
+        self._place()
+
+    @classmethod
+    def random_size(cls, obstacle_type, rng):
+        """種類ごとの範囲から rng（コースごとの random.Random）で大きさ (幅, 高さ) を決める"""
         if obstacle_type == "block":
             # 通常のブロック障害物
-            self.width = random.randint(25, 50)
-            self.height = random.randint(40, 80)
-            self.image = pygame.Surface((self.width, self.height))
-            self.image.fill(RED)
-            self.rect = self.image.get_rect()
-            self.rect.x = WIDTH
-            self.rect.y = HEIGHT - 140 - self.height
-            
-        elif obstacle_type == "spike":
+            return rng.randint(*cls.BLOCK_WIDTH), rng.randint(*cls.BLOCK_HEIGHT)
+        if obstacle_type == "spike":
             # トゲトゲの障害物（危険度高）
-            self.width = 30
-            self.height = 60
-            self.image = pygame.Surface((self.width, self.height))
-            self.image.fill((150, 0, 0))  # 暗い赤
-            # トゲトゲのパターンを描画
-            for i in range(0, self.width, 6):
-                pygame.draw.polygon(self.image, (200, 0, 0), 
-                                  [(i, self.height), (i+3, self.height-15), (i+6, self.height)])
-            self.rect = self.image.get_rect()
-            self.rect.x = WIDTH
-            self.rect.y = HEIGHT - 140 - self.height
-            
-        elif obstacle_type == "wall":
-            # 高い壁（ジャンプ必須）
-            self.width = 20
-            self.height = random.randint(100, 140)
-            self.image = pygame.Surface((self.width, self.height))
-            self.image.fill((80, 40, 0))  # 茶色
-            # レンガのパターンを描画
-            for y in range(0, self.height, 20):
-                for x in range(0, self.width, 10):
-                    if (y // 20) % 2 == 0:
-                        pygame.draw.rect(self.image, (100, 60, 20), 
-                                       (x, y, 9, 19), 1)
-                    else:
-                        pygame.draw.rect(self.image, (100, 60, 20), 
-                                       (x-5, y, 9, 19), 1)
-            self.rect = self.image.get_rect()
-            self.rect.x = WIDTH
-            self.rect.y = HEIGHT - 140 - self.height
+            return cls.SPIKE_SIZE
+        # 高い壁（ジャンプ必須）
+        return cls.WALL_WIDTH, rng.randint(*cls.WALL_HEIGHT)
 
-    def update(self):
-        self.rect.x -= self.speed
-        if self.rect.right < 0:
-            self.kill()
+    def _place(self):
+        # 描画済みのテクスチャをアトラスから取得
+        self.image = textures.get(self.obstacle_type, self.width, self.height)
+        self.rect.size = (self.width, self.height)
+        self.rect.x = WIDTH
+        self.rect.y = HEIGHT - 140 - self.height
+
+    def save_state(self):
+        """ロールバック用に状態を保存する"""
+        return (self.obstacle_type, self.width, self.height, self.rect.x)
+
+    def load_state(self, state):
+        self.obstacle_type, self.width, self.height, x = state
+        self._place()
+        self.rect.x = x
 
 # バイク選択画面クラス
 class BikeSelection:
     def __init__(self):
-        self.font = get_japanese_font(48)
-        self.small_font = get_japanese_font(32)
+        self.font = TextCache(get_japanese_font(48))
+        self.small_font = TextCache(get_japanese_font(32))
+        mark_startup("fonts")
         self.selected = 0  # 0: 1人プレイ, 1: 2人プレイ
-        
-        # バイク画像の読み込み
-        try:
-            self.bike1_img = pygame.image.load("bike.png")
-            self.bike1_img = pygame.transform.scale(self.bike1_img, (160, 100))
-        except pygame.error:
-            self.bike1_img = pygame.Surface((160, 100))
-            self.bike1_img.fill(BLUE)
-            print("Warning: Could not load bike.png. Using default.")
-            
-        try:
-            self.bike2_img = pygame.image.load("bike2.png")
-            self.bike2_img = pygame.transform.scale(self.bike2_img, (160, 100))
-            # bike2の画像を左右反転
-            self.bike2_img = pygame.transform.flip(self.bike2_img, True, False)
-        except pygame.error:
-            self.bike2_img = pygame.Surface((160, 100))
-            self.bike2_img.fill(GREEN)
-            print("Warning: Could not load bike2.png. Using default.")
     
     def run(self):
+        display = get_screen()
+        # ウィンドウが WIDTH x HEIGHT でなければ同じ大きさのサーフェースに描いて拡大する
+        screen = display if display.get_size() == (WIDTH, HEIGHT) else pygame.Surface((WIDTH, HEIGHT)).convert()
+        # バイク画像はウィンドウ作成後にアセットキャッシュから取得（表示形式に変換済み）
+        self.bike1_img = assets.get("bike1_select")
+        self.bike2_img = assets.get("bike2_select")
+        self.bike1_small = assets.get("bike1_small")
+        self.bike2_small = assets.get("bike2_small")
         selection_done = False
         
         while not selection_done:
@@ -316,10 +862,8 @@ class BikeSelection:
             # 2人プレイ
             player2_pos = (WIDTH * 3 // 4 - 80, HEIGHT // 2 - 50)
             # 2台のバイクを並べて描画
-            bike1_small = pygame.transform.scale(self.bike1_img, (80, 50))
-            bike2_small = pygame.transform.scale(self.bike2_img, (80, 50))
-            screen.blit(bike1_small, player2_pos)
-            screen.blit(bike2_small, (player2_pos[0] + 80, player2_pos[1]))
+            screen.blit(self.bike1_small, player2_pos)
+            screen.blit(self.bike2_small, (player2_pos[0] + 80, player2_pos[1]))
             
             player2_text = self.small_font.render("2人プレイ", True, BLACK)
             screen.blit(player2_text, (WIDTH * 3 // 4 - player2_text.get_width() // 2, HEIGHT // 2 + 70))
@@ -338,17 +882,473 @@ class BikeSelection:
             instruction_text = self.small_font.render("← →キーで選択、Spaceキーで決定", True, BLACK)
             screen.blit(instruction_text, (WIDTH // 2 - instruction_text.get_width() // 2, HEIGHT - 50))
             
+            if screen is not display:
+                present(screen, display)
             pygame.display.flip()
+            report_startup()
         
         # 選択されたモードを返す
         return "single" if self.selected == 0 else "two_player"
 
-# ゲームクラス
-class Game:
-    def __init__(self, game_mode):
+# フレームプロファイラ
+def percentile(values, q):
+    """values の q パーセンタイル（最近傍順位法、values が空なら 0）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+def surface_allocations():
+    """これまでに作成したテクスチャ・テキストのサーフェース数"""
+    return textures.allocations + TextCache.total_renders
+
+class NullProfiler:
+    """計測しないときに使う何もしないプロファイラ"""
+    def clock(self):
+        return 0.0
+
+    def lap(self, name, start):
+        return start
+
+    def count(self, name, n):
+        pass
+
+    def latency(self, name, seconds):
+        pass
+
+nullprofiler = NullProfiler()
+
+class FrameProfiler(NullProfiler):
+    """フレーム内の処理ごとの時間を計測し、統計とトレースを残す
+
+    計測したい区間の前後で t = profiler.lap("名前", t) のように呼ぶ。
+    """
+    PHASES = ("events", "bot", "spawn", "bike_update", "group_update", "collision", "draw", "hud", "flip")
+    COUNTERS = ("bot_nodes", "narrow_checks", "narrow_avoided", "render_pixels")
+    # キーを押してから jump() が呼ばれるまで / 画面に出る（flip）までの遅れ
+    LATENCIES = ("jump", "flip")
+
+    def __init__(self, history=600, keep_records=False):
+        # フレームごとの記録。書き出すとき（keep_records）だけ全フレーム分を残し、それ以外は直近の history 件だけ持つ
+        self.records = [] if keep_records else collections.deque(maxlen=history)
+        self.recent = collections.deque(maxlen=history)      # 直近のフレーム時間（ms、オーバーレイ用）
+        self.frames = 0
+        self._phases = dict.fromkeys(self.PHASES, 0.0)
+        self._frame_start = None
+        self._allocations = surface_allocations()
+        self.ticks = 0
+        # フレームごとに数える値（ボットが探索した状態の数、衝突の精密判定の回数とそれを省けた回数、描いたピクセル数）
+        self._counts = dict.fromkeys(self.COUNTERS, 0)
+        self.latencies = {name: collections.deque(maxlen=history) for name in self.LATENCIES}   # ms
+        self._latency_total = {name: [] for name in self.LATENCIES}
+
+    def clock(self):
+        return time.perf_counter()
+
+    def lap(self, name, start):
+        now = time.perf_counter()
+        self._phases[name] += now - start
+        return now
+
+    def count(self, name, n):
+        self._counts[name] += n
+
+    def latency(self, name, seconds):
+        self.latencies[name].append(seconds * 1000)
+        self._latency_total[name].append(seconds * 1000)
+
+    def end_frame(self, sprites):
+        """1フレーム分の計測を確定する（前回の end_frame からをフレーム時間とする）"""
+        now = time.perf_counter()
+        if self._frame_start is not None:
+            frame_ms = (now - self._frame_start) * 1000
+            allocations = surface_allocations()
+            record = {"frame": self.frames, "frame_ms": frame_ms, "ticks": self.ticks,
+                      "sprites": sprites, "allocations": allocations - self._allocations}
+            record.update(self._counts)
+            for name, seconds in self._phases.items():
+                record[name + "_ms"] = seconds * 1000
+            self.records.append(record)
+            self.recent.append(frame_ms)
+            self.frames += 1
+            self._allocations = allocations
+        self._frame_start = now
+        self._phases = dict.fromkeys(self.PHASES, 0.0)
+        self._counts = dict.fromkeys(self.COUNTERS, 0)
+        self.ticks = 0
+
+    def summary(self):
+        frame_times = [record["frame_ms"] for record in self.records]
+        summary = {
+            "frames": len(frame_times),
+            "frame_ms_p50": percentile(frame_times, 50),
+            "frame_ms_p99": percentile(frame_times, 99),
+            "frame_ms_max": max(frame_times, default=0.0),
+        }
+        for name in self.PHASES:
+            phase_times = [record[name + "_ms"] for record in self.records]
+            summary[name + "_ms_mean"] = sum(phase_times) / len(phase_times) if phase_times else 0.0
+        for name, latencies in self._latency_total.items():
+            summary[f"press_to_{name}_ms_p50"] = percentile(latencies, 50)
+            summary[f"press_to_{name}_ms_p99"] = percentile(latencies, 99)
+        return summary
+
+    def export(self, path):
+        """トレースを書き出す（拡張子が .csv なら CSV、それ以外は JSON）"""
+        if path.endswith(".csv"):
+            fields = ["frame", "frame_ms", "ticks", "sprites", "allocations"] + list(self.COUNTERS) + [name + "_ms" for name in self.PHASES]
+            with open(path, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=fields)
+                writer.writeheader()
+                writer.writerows(self.records)
+        else:
+            with open(path, "w") as f:
+                json.dump({"summary": self.summary(), "frames": self.records}, f, indent=1)
+
+# プロファイラの表示（F3 で切り替え）
+class ProfilerOverlay(pygame.sprite.DirtySprite):
+    WIDTH, HEIGHT = 320, 314
+    HISTOGRAM_MAX_MS = 40   # ヒストグラムの横軸（これ以上は右端にまとめる）
+    REFRESH_FRAMES = 15     # 内容を描き直す間隔
+
+    def __init__(self, profiler):
+        super().__init__()
+        self.profiler = profiler
+        self.font = get_japanese_font(16)
+        self.image = pygame.Surface((self.WIDTH, self.HEIGHT), pygame.SRCALPHA)
+        self.rect = self.image.get_rect(topright=(WIDTH - 10, 70))
+        self.visible = 0
+        self._age = 0
+
+    def toggle(self):
+        self.visible = 0 if self.visible else 1
+        self._age = self.REFRESH_FRAMES
+        self.dirty = 1
+
+    def refresh(self):
+        """一定間隔で統計を描き直す"""
+        if not self.visible:
+            return
+        self._age += 1
+        if self._age < self.REFRESH_FRAMES:
+            return
+        self._age = 0
+
+        profiler = self.profiler
+        recent = list(profiler.recent)
+        last = profiler.records[-1] if profiler.records else {}
+        image = self.image
+        image.fill((0, 0, 0, 170))
+        lines = [
+            f"frame p50 {percentile(recent, 50):.2f} ms  p99 {percentile(recent, 99):.2f} ms",
+            f"sprites {last.get('sprites', 0)}  surfaces/frame {last.get('allocations', 0)}"
+            f"  bot nodes {last.get('bot_nodes', 0)}",
+            f"narrow checks {last.get('narrow_checks', 0)}  avoided {last.get('narrow_avoided', 0)}",
+            f"render {last.get('render_pixels', 0) / 1000:.0f}k px",
+        ]
+        for name in profiler.LATENCIES:
+            latencies = list(profiler.latencies[name])
+            lines.append(f"press to {name:<5}p50 {percentile(latencies, 50):5.1f} ms  p99 {percentile(latencies, 99):5.1f} ms")
+        lines += [f"{name:<13}{last.get(name + '_ms', 0.0):6.2f} ms" for name in profiler.PHASES]
+        y = 6
+        for line in lines:
+            image.blit(self.font.render(line, True, WHITE), (8, y))
+            y += 16
+
+        # フレーム時間のヒストグラム（1ms 刻み）
+        bins = [0] * self.HISTOGRAM_MAX_MS
+        for frame_ms in recent:
+            bins[min(int(frame_ms), self.HISTOGRAM_MAX_MS - 1)] += 1
+        peak = max(bins) or 1
+        bar_width = (self.WIDTH - 16) // self.HISTOGRAM_MAX_MS
+        bottom = self.HEIGHT - 6
+        for i, count in enumerate(bins):
+            height = count * 40 // peak
+            if height:
+                pygame.draw.rect(image, GREEN, (8 + i * bar_width, bottom - height, bar_width - 1, height))
+        # 16.7ms（60fps）の目安線
+        budget_x = 8 + int(1000 / SIM_HZ) * bar_width
+        pygame.draw.line(image, RED, (budget_x, bottom - 42), (budget_x, bottom))
+        self.dirty = 1
+
+OBSTACLE_TYPES = ["block", "spike", "wall"]
+
+def obstacle_weights(rules, score):
+    """スコアに応じた障害物の種類ごとの重み"""
+    weights = rules["weights"]
+    for threshold, step_weights in rules["weight_steps"]:
+        if score > threshold:
+            weights = step_weights
+    return weights
+
+def course_placements(seed, rules=None, score=0):
+    """コースの配置を出現するティック順に無限に生成するジェネレータ
+
+    障害物は (ティック, "obstacle", 種類, 幅, 高さ)、坂は (ティック, "slope", 種類)。
+    ティックごとの生成間隔のタイマーとスコアに応じた重みで、random.Random(seed) から決まった順番で乱数を引く。
+    score はゲーム開始時のスコア（スコアは Simulation と同じく1ティックごとに 0.2 ずつ足していく）。
+    """
+    rules = dict(DEFAULT_RULES, **(rules or {}))
+    rng = random.Random(seed)
+    # 毎ティック回るのでルールはローカル変数にしておく
+    spawn_min, spawn_base, spawn_score_step = rules["spawn_min"], rules["spawn_base"], rules["spawn_score_step"]
+    slope_interval, slope_chance = rules["slope_interval"], rules["slope_chance"]
+    obstacle_timer = 0
+    slope_timer = 0
+    tick = 0
+    # 生成間隔はスコアが段階の境目に近づいたティックだけ計算し直す
+    recheck = score
+    while True:
+        if score >= recheck:
+            level = int(score // spawn_score_step)
+            spawn_rate = max(spawn_min, spawn_base - level)
+            recheck = (level + 1) * spawn_score_step - 1
+
+        # 障害物の生成（スコアに応じて生成頻度上昇）
+        obstacle_timer += 1
+        if obstacle_timer >= spawn_rate:
+            # 障害物の種類をスコアに応じた重みでランダムに選択
+            obstacle_type = rng.choices(OBSTACLE_TYPES, weights=obstacle_weights(rules, score))[0]
+            yield (tick, "obstacle", obstacle_type, *Obstacle.random_size(obstacle_type, rng))
+            obstacle_timer = 0
+
+        # 坂の生成
+        slope_timer += 1
+        if slope_timer >= slope_interval and rng.random() < slope_chance:
+            yield (tick, "slope", rng.choice(["up", "down"]))
+            slope_timer = 0
+
+        score += 0.2
+        tick += 1
+
+class CourseChunk:
+    """コースの一区間（CHUNK_TICKS ティック分）の配置と地面の高さマップ
+
+    index 番目の区間はティック [index * CHUNK_TICKS, (index + 1) * CHUNK_TICKS) に出現する配置と、
+    そのあいだに画面右端から入ってくるワールド座標の列の高さを持つ。
+    """
+    def __init__(self, index, obstacles, slopes):
+        self.index = index
+        self.obstacles = obstacles  # [(ティック, 種類, 幅, 高さ)]
+        self.slopes = slopes        # [(ティック, 種類)]
+        # ティック -> そのティックに出現する配置（障害物が先、坂が後）
+        self.spawns = collections.defaultdict(list)
+        for tick, obstacle_type, width, height in obstacles:
+            self.spawns[tick].append(("obstacle", obstacle_type, width, height))
+        for tick, slope_type in slopes:
+            self.spawns[tick].append(("slope", slope_type))
+        self.heightmap = None
+
+class Course:
+    """シードから決まるコースを、数秒先まで区間（CourseChunk）単位で先に作っておくパイプライン
+
+    区間は course_placements の配置をまとめたもので、出現する配置と、列ごとの地面の高さ（坂の表面の y、
+    坂のない列は NaN）を持つ。地面の高さは区間を作るときに1度だけ計算するので、毎ティックの地面の判定は
+    配列を1回引くだけになる。ワールド座標の列は「画面上の x + SCROLL_SPEED * ティック」で、
+    ティック t に出現するものの左端は WIDTH + SCROLL_SPEED * t になる（ScrollIndex と同じ座標）。
+
+    fixed は固定コース（save で書き出したもの）の区間ごとの配置で、固定コースの後はシードから生成を続ける。
+    """
+    CHUNK_TICKS = 2 * SIM_HZ
+    CHUNK_COLUMNS = CHUNK_TICKS * SCROLL_SPEED
+    LOOKAHEAD_CHUNKS = 2  # 今の区間より先に用意しておく区間の数
+    FORMAT = "bike-course"
+    VERSION = 1
+    # 坂のない区間の高さと、坂の左端からの列ごとの表面の高さ（0 〜 Slope.WIDTH の Slope.WIDTH + 1 列）
+    _NO_SLOPE = array("d", [math.nan]) * CHUNK_COLUMNS
+    _RAMPS = {slope_type: array("d", [Slope.surface_height(slope_type, x) for x in range(Slope.WIDTH + 1)])
+              for slope_type in ("up", "down")}
+
+    def __init__(self, seed, rules=None, score=0, fixed=()):
+        self.seed = seed
+        self.rules = dict(DEFAULT_RULES, **(rules or {}))
+        self.score = score
+        self.fixed = list(fixed)
+        self._chunks = {}
+        self._pipeline = self._generate()
+        self._next_index = 0
+        self._first_index = 0
+        self.generated = 0
+
+    def _generate(self):
+        """区間を順番に作るジェネレータ"""
+        placements = course_placements(self.seed, self.rules, self.score)
+        pending = next(placements)
+        index = 0
+        while True:
+            end = (index + 1) * self.CHUNK_TICKS
+            if index < len(self.fixed):
+                obstacles, slopes = (list(map(tuple, group)) for group in self.fixed[index])
+                # 固定コースの範囲の配置は生成したものを捨てる（その後のシードからの生成とつなげるため）
+                while pending[0] < end:
+                    pending = next(placements)
+            else:
+                obstacles, slopes = [], []
+                while pending[0] < end:
+                    if pending[1] == "obstacle":
+                        obstacles.append((pending[0], *pending[2:]))
+                    else:
+                        slopes.append((pending[0], pending[2]))
+                    pending = next(placements)
+            yield CourseChunk(index, obstacles, slopes)
+            index += 1
+
+    def chunk(self, index):
+        """index 番目の区間（まだなければここまで作る）"""
+        while self._next_index <= index:
+            chunk = next(self._pipeline)
+            self._chunks[chunk.index] = chunk
+            self._paint(chunk)
+            self._next_index += 1
+            self.generated += 1
+        return self._chunks[index]
+
+    def _paint(self, chunk, first=0, last=None):
+        """区間の列 [first, last) の地面の高さを計算する（坂が重なる列は古い坂を使う）"""
+        if last is None:
+            last = self.CHUNK_COLUMNS
+        if chunk.heightmap is None:
+            chunk.heightmap = array("d", [math.nan]) * self.CHUNK_COLUMNS
+        heightmap = chunk.heightmap
+        heightmap[first:last] = self._NO_SLOPE[first:last]
+        left = WIDTH + chunk.index * self.CHUNK_COLUMNS
+        previous = self._chunks.get(chunk.index - 1)
+        slopes = (previous.slopes if previous is not None else []) + chunk.slopes
+        # 坂ごとに計算済みの表面の高さを切り出して代入する。新しい坂から塗り、重なる列は古い坂で上書きする
+        for tick, slope_type in reversed(slopes):
+            start = WIDTH + tick * SCROLL_SPEED - left
+            lo = max(start, first)
+            hi = min(start + Slope.WIDTH + 1, last)
+            if lo < hi:
+                heightmap[lo:hi] = self._RAMPS[slope_type][lo - start:hi - start]
+
+    def prefetch(self, tick):
+        """ティック tick から LOOKAHEAD_CHUNKS 区間先までを作り、画面の左に流れ去った区間を捨てる
+
+        巻き戻し（ロールバック）に備えて1区間分は余分に残す。
+        """
+        self.chunk(tick // self.CHUNK_TICKS + self.LOOKAHEAD_CHUNKS)
+        first = (SCROLL_SPEED * (tick - self.CHUNK_TICKS) - WIDTH) // self.CHUNK_COLUMNS
+        while self._first_index < first:
+            self._chunks.pop(self._first_index, None)
+            self._first_index += 1
+
+    def spawns_at(self, tick):
+        """ティック tick に出現する配置"""
+        return self.chunk(tick // self.CHUNK_TICKS).spawns.get(tick, ())
+
+    def surface(self, column):
+        """ワールド座標の列 column の地面の高さ（坂のない列は NaN）"""
+        if column < WIDTH:
+            return math.nan
+        index, offset = divmod(column - WIDTH, self.CHUNK_COLUMNS)
+        return self.chunk(index).heightmap[offset]
+
+    def surfaces(self, left, right):
+        """ワールド座標の列 [left, right) の地面の高さの配列"""
+        out = array("d")
+        column = left
+        while column < right:
+            if column < WIDTH:
+                count = min(right, WIDTH) - column
+                out.extend(array("d", [math.nan]) * count)
+            else:
+                index, offset = divmod(column - WIDTH, self.CHUNK_COLUMNS)
+                count = min(self.CHUNK_COLUMNS - offset, right - column)
+                out.extend(self.chunk(index).heightmap[offset:offset + count])
+            column += count
+        return out
+
+    def add_slope(self, tick, slope_type):
+        """コースの外から坂を出現させたとき（ベンチマークなど）に高さマップに加える"""
+        index = tick // self.CHUNK_TICKS
+        chunk = self.chunk(index)
+        # 同じティックのコースの坂より先に出現する
+        chunk.slopes.insert(bisect.bisect_left(chunk.slopes, (tick,)), (tick, slope_type))
+        # 塗り直すのは坂がかかる列だけ（次の区間にはみ出す分も）
+        first = tick * SCROLL_SPEED - index * self.CHUNK_COLUMNS
+        self._paint(chunk, first, min(first + Slope.WIDTH + 1, self.CHUNK_COLUMNS))
+        following = self._chunks.get(index + 1)
+        if following is not None and first + Slope.WIDTH + 1 > self.CHUNK_COLUMNS:
+            self._paint(following, 0, first + Slope.WIDTH + 1 - self.CHUNK_COLUMNS)
+
+    def to_dict(self, ticks):
+        """最初の ticks ティック分を固定コースとして書き出せる辞書にする"""
+        chunks = []
+        for index in range(-(-ticks // self.CHUNK_TICKS)):
+            chunk = self.chunk(index)
+            chunks.append({"obstacles": [list(placement) for placement in chunk.obstacles],
+                           "slopes": [list(placement) for placement in chunk.slopes]})
+        overrides = {name: value for name, value in self.rules.items() if DEFAULT_RULES.get(name) != value}
+        return {"format": self.FORMAT, "version": self.VERSION, "seed": self.seed, "score": self.score,
+                "rules": overrides, "chunk_ticks": self.CHUNK_TICKS, "chunks": chunks}
+
+    @classmethod
+    def from_dict(cls, data):
+        if data.get("format") != cls.FORMAT or data.get("version") != cls.VERSION:
+            raise ValueError("not a course file (or unsupported version)")
+        if data["chunk_ticks"] != cls.CHUNK_TICKS:
+            raise ValueError(f"course chunks are {data['chunk_ticks']} ticks, expected {cls.CHUNK_TICKS}")
+        fixed = [(chunk["obstacles"], chunk["slopes"]) for chunk in data["chunks"]]
+        return cls(data["seed"], data["rules"], data["score"], fixed)
+
+    def save(self, path, ticks):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(ticks), f, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    def restarted(self, score=None):
+        """同じコースを最初から作り直したもの"""
+        return Course(self.seed, self.rules, self.score if score is None else score, self.fixed)
+
+# シミュレーションクラス（描画を一切行わないゲームロジック本体）
+class Simulation:
+    def __init__(self, game_mode="single", seed=None, rules=None, track=None):
         self.game_mode = game_mode
-        
-        if game_mode == "single":
+        # 指定されなかったルールは DEFAULT_RULES の値を使う
+        self.rules = dict(DEFAULT_RULES, **(rules or {}))
+        # 固定コース（Course.load で読み込んだもの）。指定したときはシードと障害物の出現は固定コースのものになる
+        self.track = track
+        # 障害物と坂は使い回す（トゲと上り坂は乱数を使わないので事前生成に使える）
+        self.obstacle_pool = SpritePool(lambda: Obstacle("spike"), size=8)
+        self.slope_pool = SpritePool(lambda: Slope("up"), size=2)
+        self.obstacles = None
+        self.slopes = None
+        self.profiler = nullprofiler
+        # 精密判定を行った回数と、矩形での大まかな判定で省けた回数（リセットしても累積する）
+        self.narrow_checks = 0
+        self.narrow_avoided = 0
+        textures.warm()
+        masks.warm()
+        self.reset(seed)
+
+    def reset(self, seed=None, score=0):
+        """ゲーム状態を初期化して最初の状態を返す
+
+        障害物と坂の出現はシードから決まるコース（Course）で先に作っておくので、同じシードなら同じ障害物列が出る。
+        seed が None のときはランダムに決めたシードを self.seed に残す（リプレイの記録に使う）。
+        score は開始時のスコア（後半の難易度から始めるときに使う）。
+        """
+        if self.track is not None:
+            self.course = self.track.restarted()
+            seed, score = self.track.seed, self.track.score
+        else:
+            if seed is None:
+                seed = random.randrange(2 ** 32)
+            self.course = Course(seed, self.rules, score)
+        self.seed = seed
+
+        # 前のゲームの障害物と坂をプールに戻す
+        if self.obstacles is not None:
+            self.obstacle_pool.release_all(self.obstacles)
+            self.slope_pool.release_all(self.slopes)
+
+        if self.game_mode == "single":
             self.bike1 = Bike("bike1", 1)
             self.bike2 = None
             self.bikes = [self.bike1]
@@ -356,154 +1356,1436 @@ class Game:
             self.bike1 = Bike("bike1", 1)
             self.bike2 = Bike("bike2", 2)
             self.bikes = [self.bike1, self.bike2]
-        
+
         self.all_sprites = pygame.sprite.Group()
         self.obstacles = pygame.sprite.Group()
         self.slopes = pygame.sprite.Group()
-        
+        # 地面の高さと衝突判定用の x 座標順の索引
+        self.obstacle_index = ScrollIndex()
+        self.slope_index = ScrollIndex()
+
         for bike in self.bikes:
             self.all_sprites.add(bike)
-            
-        self.score = 0
-        self.font = get_japanese_font(36)
-        self.small_font = get_japanese_font(24)
-        self.obstacle_timer = 0
-        self.slope_timer = 0
+            self._apply_rules(bike)
+
+        self.frame = 0
+        self.score = score
         self.game_over = False
         self.ground_y = HEIGHT - 140
         self.difficulty = 1
+        return self.get_state()
 
-    def run(self):
-        clock = pygame.time.Clock()
-        
-        while True:
-            # イベント処理
-            for event in pygame.event.get():
-                if event.type == pygame.QUIT:
-                    pygame.quit()
-                    sys.exit()
-                if event.type == pygame.KEYDOWN:
-                    if event.key == pygame.K_SPACE:
-                        if self.game_mode == "single":
-                            self.bike1.jump()
-                    # 2人プレイの場合のキー入力
-                    elif event.key == pygame.K_LMETA or event.key == pygame.K_RMETA:  # Cmdキー
-                        if self.bike1:
-                            self.bike1.jump()
-                    elif event.key == pygame.K_LALT or event.key == pygame.K_RALT:  # Optionキー
-                        if self.bike2:
-                            self.bike2.jump()
-                    elif event.key == pygame.K_r and self.game_over:
-                        # ゲームリセット（バイク選択画面に戻る）
-                        return True
-
-            if not self.game_over:
-                # 障害物の生成（難易度を下げるため壁の出現確率を下げる）
-                self.obstacle_timer += 1
-                spawn_rate = max(40, 100 - int(self.score // 50))  # スコアに応じて生成頻度上昇
-                
-                if self.obstacle_timer >= spawn_rate:
-                    # 障害物の種類をランダムに選択（壁の確率を大幅に下げる）
-                    obstacle_types = ["block", "spike", "wall"]
-                    weights = [60, 35, 5]  # 壁の出現確率を20%から5%に下げる
-                    
-                    # 難易度が上がっても壁の確率は低く保つ
-                    if self.score > 100:
-                        weights = [50, 40, 10]
-                    if self.score > 300:
-                        weights = [40, 45, 15]
-                    
-                    obstacle_type = random.choices(obstacle_types, weights=weights)[0]
-                    obstacle = Obstacle(obstacle_type)
-                    self.obstacles.add(obstacle)
-                    self.all_sprites.add(obstacle)
-                    self.obstacle_timer = 0
-
-                # 坂の生成
-                self.slope_timer += 1
-                slope_spawn_rate = 200  # 坂の生成頻度（フレーム数）
-                
-                if self.slope_timer >= slope_spawn_rate and random.random() < 0.7:  # 70%の確率で坂を生成
-                    slope_type = random.choice(["up", "down"])
-                    slope = Slope(slope_type)
-                    self.slopes.add(slope)
-                    self.all_sprites.add(slope)
-                    self.slope_timer = 0
-
-                # スプライトの更新（バイクに坂の情報を渡す）
-                for bike in self.bikes:
-                    bike.update(self.slopes)
-                    
-                self.obstacles.update()
-                self.slopes.update()
-
-                # 衝突判定（各バイク個別に判定）
-                for bike in self.bikes:
-                    if not bike.crashed and pygame.sprite.spritecollide(bike, self.obstacles, False):
-                        bike.crash()
-
-                # 全バイクがクラッシュしたかチェック
-                all_crashed = all(bike.crashed for bike in self.bikes)
-                if all_crashed:
-                    self.game_over = True
-
-                # スコア更新
-                self.score += 0.2
-                self.difficulty = int(self.score // 100) + 1
+    def step(self, inputs=()):
+        """1フレーム分ゲームを進める
 
-            # 描画
-            screen.fill(WHITE)
-            
-            # 地面の描画
-            pygame.draw.rect(screen, GRAY, (0, self.ground_y, WIDTH, HEIGHT - self.ground_y))
-            
-            # スプライトの描画
-            self.all_sprites.draw(screen)
-            
-            # スコアと難易度の表示
-            score_text = self.font.render(f"Score: {int(self.score)}", True, BLACK)
-            screen.blit(score_text, (10, 10))
-            
-            difficulty_text = self.font.render(f"Level: {self.difficulty}", True, BLACK)
-            screen.blit(difficulty_text, (10, 50))
-            
-            # プレイヤー状態の表示
-            if self.game_mode == "two_player":
-                player1_status = "Player1: " + ("CRASHED" if self.bike1.crashed else "OK")
-                player2_status = "Player2: " + ("CRASHED" if self.bike2.crashed else "OK")
-                
-                player1_color = RED if self.bike1.crashed else GREEN
-                player2_color = RED if self.bike2.crashed else GREEN
-                
-                p1_text = self.small_font.render(player1_status, True, player1_color)
-                p2_text = self.small_font.render(player2_status, True, player2_color)
-                
-                screen.blit(p1_text, (WIDTH - 200, 10))
-                screen.blit(p2_text, (WIDTH - 200, 35))
-            
-            # 操作説明
-            if self.score < 50:
-                if self.game_mode == "single":
-                    instruction_text = self.small_font.render("SPACE to jump!", True, BLACK)
-                    screen.blit(instruction_text, (10, 90))
+        inputs はバイクごとのジャンプ入力（True でジャンプ）のシーケンス。
+        """
+        for bike, pressed in zip(self.bikes, inputs):
+            if pressed:
+                bike.jump()
+
+        if not self.game_over:
+            profiler = self.profiler
+            t = profiler.clock()
+
+            # コースのうちこのティックに出現する障害物と坂を出す（区間の切り替わりで先の区間を用意する）
+            course = self.course
+            if self.frame % Course.CHUNK_TICKS == 0:
+                course.prefetch(self.frame)
+            for spawn in course.spawns_at(self.frame):
+                if spawn[0] == "obstacle":
+                    self.spawn_obstacle(*spawn[1:])
+                else:
+                    self._add_slope(spawn[1])
+            t = profiler.lap("spawn", t)
+
+            # スプライトの更新（バイクに坂の情報とコースの高さマップを渡す）
+            narrow = avoided = 0
+            for bike in self.bikes:
+                if not bike.crashed:
+                    checks = bike.update(self.slope_index, course)
+                    narrow += checks
+                    avoided += len(self.slopes) - checks
                 else:
-                    instruction_text1 = self.small_font.render("Player1: Cmd to jump!", True, BLACK)
-                    instruction_text2 = self.small_font.render("Player2: Option to jump!", True, BLACK)
-                    screen.blit(instruction_text1, (10, 90))
-                    screen.blit(instruction_text2, (10, 115))
+                    bike.update(self.slope_index, course)
+            t = profiler.lap("bike_update", t)
+
+            self.obstacles.update()
+            self.slopes.update()
+            self.obstacle_index.advance(SCROLL_SPEED)
+            self.slope_index.advance(SCROLL_SPEED)
+            t = profiler.lap("group_update", t)
+
+            # 衝突判定（各バイク個別に、x 範囲が重なり矩形も重なる障害物だけをマスクで精密に調べる）
+            for bike in self.bikes:
+                if not bike.crashed:
+                    rect = bike.rect
+                    bike_mask = masks.get(bike.image)
+                    checks = 0
+                    for obstacle in self.obstacle_index.overlapping(rect.left, rect.right):
+                        if rect.colliderect(obstacle.rect):
+                            checks += 1
+                            offset = (obstacle.rect.x - rect.x, obstacle.rect.y - rect.y)
+                            if bike_mask.overlap(masks.get(obstacle.image), offset):
+                                bike.crash()
+                                break
+                    narrow += checks
+                    avoided += len(self.obstacles) - checks
+            self.narrow_checks += narrow
+            self.narrow_avoided += avoided
+            profiler.count("narrow_checks", narrow)
+            profiler.count("narrow_avoided", avoided)
+            profiler.lap("collision", t)
+
+            # 全バイクがクラッシュしたかチェック
+            all_crashed = all(bike.crashed for bike in self.bikes)
+            if all_crashed:
+                self.game_over = True
+
+            # スコア更新
+            self.score += 0.2
+            self.difficulty = int(self.score // 100) + 1
+            self.frame += 1
+
+        return self.get_state()
+
+    def spawn_obstacle(self, obstacle_type, width=None, height=None):
+        """画面右端に障害物を出現させる（大きさを省略したときはランダム）"""
+        obstacle = self.obstacle_pool.acquire(obstacle_type, width, height)
+        self.obstacles.add(obstacle)
+        self.all_sprites.add(obstacle)
+        self.obstacle_index.add(obstacle)
+        return obstacle
+
+    def spawn_slope(self, slope_type):
+        """コースにない坂を画面右端に出現させる（地面の高さはコースの高さマップに加える）"""
+        self.course.add_slope(self.frame, slope_type)
+        return self._add_slope(slope_type)
+
+    def _add_slope(self, slope_type):
+        slope = self.slope_pool.acquire(slope_type)
+        self.slopes.add(slope)
+        self.all_sprites.add(slope)
+        self.slope_index.add(slope)
+        return slope
+
+    def add_bike(self, bike_type="bike1", player_id=None, x=None):
+        """バイクを追加する（ベンチマークなどで3台以上走らせる場合）"""
+        bike = Bike(bike_type, player_id or len(self.bikes) + 1)
+        if x is not None:
+            bike.rect.x = x
+        self._apply_rules(bike)
+        self.bikes.append(bike)
+        self.all_sprites.add(bike)
+        return bike
+
+    def _apply_rules(self, bike):
+        bike.gravity = self.rules["gravity"]
+        bike.jump_velocity = self.rules["jump_velocity"]
 
-            # ゲームオーバー表示
-            if self.game_over:
-                game_over_text = self.font.render("GAME OVER - Press R to restart", True, BLACK)
-                screen.blit(game_over_text, (WIDTH // 2 - 180, HEIGHT // 2))
+    def snapshot(self):
+        """ロールバック用にゲーム状態全体を保存する（restore で戻せる）"""
+        scrolling = [(isinstance(sprite, Slope), sprite.save_state())
+                     for sprite in self.all_sprites if not isinstance(sprite, Bike)]
+        # コースはシードから決まり、ティックが戻っても変わらないので保存しない
+        return (self.frame, self.score, self.game_over, self.difficulty,
+                [bike.save_state() for bike in self.bikes], scrolling,
+                self.obstacle_index.scroll, self.slope_index.scroll)
 
+    def restore(self, snapshot):
+        """snapshot で保存した状態に戻す"""
+        (self.frame, self.score, self.game_over, self.difficulty,
+         bikes, scrolling, obstacle_scroll, slope_scroll) = snapshot
+        for bike, state in zip(self.bikes, bikes):
+            bike.load_state(state)
+
+        # 障害物と坂はプールに戻してから作り直し、索引も出現順に登録し直す
+        self.obstacle_pool.release_all(self.obstacles)
+        self.slope_pool.release_all(self.slopes)
+        self.obstacle_index = ScrollIndex()
+        self.slope_index = ScrollIndex()
+        self.obstacle_index.scroll = obstacle_scroll
+        self.slope_index.scroll = slope_scroll
+        for is_slope, state in scrolling:
+            if is_slope:
+                sprite, group, index = self.slope_pool.take(), self.slopes, self.slope_index
+            else:
+                sprite, group, index = self.obstacle_pool.take(), self.obstacles, self.obstacle_index
+            sprite.load_state(state)
+            group.add(sprite)
+            self.all_sprites.add(sprite)
+            index.add(sprite)
+
+    def checksum(self):
+        """ゲーム状態（コースのシードを含む）の CRC32。決定性の確認に使う"""
+        state = (
+            self.seed, self.frame, self.score, self.game_over,
+            [(bike.rect.x, bike.rect.y, bike.velocity_y, bike.jumping, bike.crashed) for bike in self.bikes],
+            [(o.obstacle_type, o.rect.x, o.rect.y, o.width, o.height) for o in self.obstacles],
+            [(slope.slope_type, slope.rect.x, slope.rect.y) for slope in self.slopes],
+        )
+        return zlib.crc32(repr(state).encode())
+
+    def get_state(self):
+        """現在の状態を描画に依存しない辞書で返す"""
+        return {
+            "frame": self.frame,
+            "score": self.score,
+            "difficulty": self.difficulty,
+            "game_over": self.game_over,
+            "bikes": [
+                {
+                    "x": bike.rect.x,
+                    "y": bike.rect.y,
+                    "width": bike.rect.width,
+                    "height": bike.rect.height,
+                    "bike_type": bike.bike_type,
+                    "velocity_y": bike.velocity_y,
+                    "jumping": bike.jumping,
+                    "crashed": bike.crashed,
+                }
+                for bike in self.bikes
+            ],
+            "obstacles": [
+                (obstacle.obstacle_type, obstacle.rect.x, obstacle.rect.y, obstacle.width, obstacle.height)
+                for obstacle in self.obstacles
+            ],
+            "slopes": [(slope.slope_type, slope.rect.x, slope.rect.y) for slope in self.slopes],
+        }
+
+REPLAY_MAGIC = b"BKRP"
+# シミュレーションの結果が変わる変更をしたら上げる（古いリプレイは照合できないので読み込まない）
+REPLAY_VERSION = 1
+REPLAY_MODES = ["single", "two_player"]
+REPLAY_HEADER = struct.Struct("<4sBBQII")
+
+def _write_varint(out, value):
+    """非負整数を 7 ビットずつの可変長で out（bytearray）に追加する"""
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+def _read_varint(data, pos):
+    """pos から可変長整数を読み、(値, 次の位置) を返す"""
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+class Replay:
+    """1ゲーム分のリプレイ（シードとプレイヤーごとのジャンプしたティック番号）
+
+    シミュレーションは決定的なので、シード・ルール・入力だけで同じゲームを再現できる。
+    ファイル形式（リトルエンディアン）:
+        "BKRP", バージョン u8, モード u8, シード u64, 最終ティック u32, 最終状態のチェックサム u32,
+        ルールの上書き JSON（長さ u16 + 本体）, プレイヤー数 u8,
+        プレイヤーごとに ジャンプ回数 varint + 前のジャンプとのティック差 varint の列
+    """
+    def __init__(self, game_mode="single", seed=0, rules=None, players=1):
+        self.game_mode = game_mode
+        self.seed = seed
+        self.rules = rules or {}
+        self.jumps = [[] for _ in range(players)]
+        self.final_frame = 0
+        self.checksum = 0
+        self._jump_sets = None
+
+    @classmethod
+    def start(cls, sim):
+        """sim の現在のゲーム（reset 直後）を記録するリプレイを作る"""
+        overrides = {name: value for name, value in sim.rules.items() if DEFAULT_RULES.get(name) != value}
+        return cls(sim.game_mode, sim.seed, overrides, len(sim.bikes))
+
+    def record(self, frame, inputs):
+        """ティック frame で step に渡す入力を記録する"""
+        for jumps, pressed in zip(self.jumps, inputs):
+            if pressed:
+                jumps.append(frame)
+
+    def finish(self, sim):
+        """最終ティックと最終状態のチェックサムを記録する"""
+        self.final_frame = sim.frame
+        self.checksum = sim.checksum()
+
+    def inputs_at(self, frame):
+        """ティック frame の入力（バイクごとのジャンプ）"""
+        if self._jump_sets is None:
+            self._jump_sets = [set(jumps) for jumps in self.jumps]
+        return [frame in jumps for jumps in self._jump_sets]
+
+    def to_bytes(self):
+        out = bytearray(REPLAY_HEADER.pack(REPLAY_MAGIC, REPLAY_VERSION, REPLAY_MODES.index(self.game_mode),
+                                           self.seed, self.final_frame, self.checksum))
+        rules = json.dumps(self.rules, separators=(",", ":")).encode() if self.rules else b""
+        out += struct.pack("<H", len(rules)) + rules
+        out.append(len(self.jumps))
+        for jumps in self.jumps:
+            _write_varint(out, len(jumps))
+            previous = 0
+            for frame in jumps:
+                _write_varint(out, frame - previous)
+                previous = frame
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data):
+        magic, version, mode, seed, final_frame, checksum = REPLAY_HEADER.unpack_from(data)
+        if magic != REPLAY_MAGIC:
+            raise ValueError("not a replay file")
+        if version != REPLAY_VERSION:
+            raise ValueError(f"unsupported replay version {version} (this game reads version {REPLAY_VERSION}; "
+                             f"replays recorded with other versions of the game cannot be reproduced)")
+        pos = REPLAY_HEADER.size
+        (length,) = struct.unpack_from("<H", data, pos)
+        pos += 2
+        rules = json.loads(data[pos:pos + length]) if length else {}
+        pos += length
+        replay = cls(REPLAY_MODES[mode], seed, rules, data[pos])
+        pos += 1
+        for jumps in replay.jumps:
+            count, pos = _read_varint(data, pos)
+            frame = 0
+            for _ in range(count):
+                delta, pos = _read_varint(data, pos)
+                frame += delta
+                jumps.append(frame)
+        replay.final_frame = final_frame
+        replay.checksum = checksum
+        return replay
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return cls.from_bytes(f.read())
+
+def play_replay(replay, track=None):
+    """リプレイを描画なしで最高速で再生し、最終状態のチェックサムを照合する
+
+    固定コースで記録したリプレイは同じ track を渡す必要がある。
+    """
+    sim = Simulation(replay.game_mode, replay.seed, replay.rules, track)
+    start = time.perf_counter()
+    while sim.frame < replay.final_frame and not sim.game_over:
+        sim.step(replay.inputs_at(sim.frame))
+    elapsed = time.perf_counter() - start
+    checksum = sim.checksum()
+    return {
+        "frames": sim.frame,
+        "elapsed": elapsed,
+        "checksum": checksum,
+        "expected": replay.checksum,
+        "match": sim.frame == replay.final_frame and checksum == replay.checksum,
+    }
+
+# 描画クラス（毎フレーム画面全体を描き直す）
+class FullRenderer:
+    NAME = "full redraw"
+
+    def __init__(self, game):
+        self.game = game
+        self.frames = 0
+        self.pixels_pushed = 0
+
+    @staticmethod
+    def interpolation(sim, alpha):
+        """描画に使う補間係数（止まっているゲームは補間しない）"""
+        return 1.0 if sim.game_over else alpha
+
+    def render(self, screen, alpha=1.0):
+        """1フレーム描画して画面に反映
+
+        alpha は前のティックから現在のティックまでの経過割合（0〜1）で、スプライトの位置を補間する。
+        """
+        t = self.draw(screen, alpha)
+        pygame.display.flip()
+        self.game.profiler.lap("flip", t)
+        self.frames += 1
+        self.pixels_pushed += WIDTH * HEIGHT
+
+    def draw(self, surface, alpha=1.0):
+        """画面に反映せずにサーフェースへ描画する（オフスクリーン描画にも使える）"""
+        screen = surface
+        sim = self.game.sim
+        profiler = self.game.profiler
+        t = profiler.clock()
+        alpha = self.interpolation(sim, alpha)
+        profiler.count("render_pixels", screen.get_width() * screen.get_height())
+        screen.fill(WHITE)
+
+        # 地面の描画
+        pygame.draw.rect(screen, GRAY, (0, sim.ground_y, WIDTH, HEIGHT - sim.ground_y))
+
+        # ゴーストはスプライトより奥にまとめて描く
+        if self.game.ghosts is not None:
+            self.game.ghosts.draw(screen, alpha)
+
+        # スプライトの描画（補間した位置にまとめて転送）
+        screen.blits([(sprite.image, sprite.interpolated_pos(alpha)) for sprite in sim.all_sprites],
+                     doreturn=False)
+        t = profiler.lap("draw", t)
+
+        # スコアなどの表示
+        for _, font, text, color, pos in self.game.hud_items():
+            screen.blit(font.render(text, True, color), pos)
+        overlay = self.game.overlay
+        overlay.refresh()
+        if overlay.visible:
+            screen.blit(overlay.image, overlay.rect)
+        return profiler.lap("hud", t)
+
+    def stats(self):
+        """1フレームあたりの転送ピクセル数"""
+        average = self.pixels_pushed / self.frames if self.frames else 0
+        return {"frames": self.frames, "pixels_per_frame": average,
+                "full_redraw_ratio": average / (WIDTH * HEIGHT)}
+
+# HUD のテキスト（値が変わったときだけ再描画される）
+class HudText(pygame.sprite.DirtySprite):
+    def __init__(self):
+        super().__init__()
+        self.text = None
+        self.color = None
+        self.image = pygame.Surface((0, 0))
+        self.rect = self.image.get_rect()
+        self.visible = 0
+
+    def set_text(self, font, text, color, pos):
+        if text != self.text or color != self.color or pos != self.rect.topleft:
+            self.text = text
+            self.color = color
+            self.image = font.render(text, True, color)
+            self.rect = self.image.get_rect(topleft=pos)
+            self.dirty = 1
+        if not self.visible:
+            self.visible = 1
+            self.dirty = 1
+
+    def hide(self):
+        if self.visible:
+            self.visible = 0
+            self.dirty = 1
+
+# 描画クラス（変化した部分だけを画面に反映する）
+class DirtyRenderer(FullRenderer):
+    NAME = "dirty-rect"
+
+    def __init__(self, game):
+        super().__init__(game)
+        # 背景と地面は動かないので1枚のサーフェースにキャッシュ
+        self.background = pygame.Surface((WIDTH, HEIGHT)).convert()
+        self.background.fill(WHITE)
+        ground_y = game.sim.ground_y
+        pygame.draw.rect(self.background, GRAY, (0, ground_y, WIDTH, HEIGHT - ground_y))
+
+        self.group = pygame.sprite.LayeredDirty()
+        # 描画に時間がかかっても全画面更新に切り替えない
+        self.group.set_timing_threshold(float("inf"))
+        self.hud = {}
+        self.group.add(game.overlay, layer=2)
+        self.first_frame = True
+
+    def _sync_sprites(self):
+        """シミュレーションで新しく生成されたスプライトを描画グループに追加"""
+        # 画面外に出たスプライトは kill() でこのグループからも外れる
+        for sprite in self.game.sim.all_sprites:
+            if not self.group.has(sprite):
+                self.group.add(sprite, layer=0)
+
+    def _update_hud(self):
+        shown = set()
+        for name, font, text, color, pos in self.game.hud_items():
+            hud_text = self.hud.get(name)
+            if hud_text is None:
+                hud_text = self.hud[name] = HudText()
+                self.group.add(hud_text, layer=1)
+            hud_text.set_text(font, text, color, pos)
+            shown.add(name)
+        for name, hud_text in self.hud.items():
+            if name not in shown:
+                hud_text.hide()
+
+    def _interpolate(self, alpha):
+        """スプライトの rect を補間した描画位置に一時的に動かし、元の位置を返す"""
+        saved = []
+        for sprite in self.game.sim.all_sprites:
+            pos = sprite.interpolated_pos(alpha)
+            if pos != sprite.rect.topleft:
+                saved.append((sprite, sprite.rect.topleft))
+                sprite.rect.topleft = pos
+            # 前回と違う位置に描くときだけ再描画の対象にする
+            if pos != getattr(sprite, "drawn_pos", None):
+                sprite.drawn_pos = pos
+                if sprite.dirty == 0:
+                    sprite.dirty = 1
+        return saved
+
+    def render(self, screen, alpha=1.0):
+        profiler = self.game.profiler
+        t = profiler.clock()
+        self._update_hud()
+        self.game.overlay.refresh()
+        t = profiler.lap("hud", t)
+
+        self._sync_sprites()
+        saved = self._interpolate(self.interpolation(self.game.sim, alpha))
+
+        if self.first_frame:
+            # 最初のフレームだけ背景ごと全体を描いて転送
+            self.group.clear(screen, self.background)
+            self.group.repaint_rect(screen.get_rect())
+            self.group.draw(screen)
+            t = profiler.lap("draw", t)
             pygame.display.flip()
-            clock.tick(60)
-            
+            self.first_frame = False
+            rects = [screen.get_rect()]
+        else:
+            rects = self.group.draw(screen)
+            t = profiler.lap("draw", t)
+            pygame.display.update(rects)
+        profiler.lap("flip", t)
+
+        # シミュレーションの位置に戻す
+        for sprite, pos in saved:
+            sprite.rect.topleft = pos
+
+        pixels = sum(rect.width * rect.height for rect in rects)
+        profiler.count("render_pixels", pixels)
+        self.frames += 1
+        self.pixels_pushed += pixels
+
+# 解像度に依存しない描画（内部解像度で描いてウィンドウに拡大する）
+def letterbox(size):
+    """WIDTH x HEIGHT の縦横比を保ったまま size に収まる最大の領域（余りは上下か左右の黒帯）"""
+    k = min(size[0] / WIDTH, size[1] / HEIGHT)
+    area = pygame.Rect(0, 0, round(WIDTH * k), round(HEIGHT * k))
+    area.center = (size[0] // 2, size[1] // 2)
+    return area
+
+def present(surface, display, smooth=True):
+    """surface を display の letterbox 領域いっぱいに拡大（縮小）して転送する"""
+    area = letterbox(display.get_size())
+    if surface.get_size() == area.size:
+        display.blit(surface, area)
+        return
+    target = display.subsurface(area)
+    if smooth:
+        pygame.transform.smoothscale(surface, area.size, target)
+    else:
+        pygame.transform.scale(surface, area.size, target)
+
+def scale_image(image, scale):
+    """画像を scale 倍にしたコピー（透明色を使う画像は色が混ざらないよう最近傍で拡大縮小する）"""
+    size = (max(1, round(image.get_width() * scale)), max(1, round(image.get_height() * scale)))
+    if image.get_colorkey() is not None or image.get_bitsize() < 24:
+        scaled = pygame.transform.scale(image, size)
+    else:
+        scaled = pygame.transform.smoothscale(image, size)
+    if image.get_alpha() is not None:
+        scaled.set_alpha(image.get_alpha())
+    return scaled
+
+class QualityGovernor:
+    """描画の品質（内部解像度と拡大の方法）をフレームの処理時間に合わせて切り替える
+
+    画面への反映（垂直同期の待ち）を除いた1フレームの処理時間の直近 WINDOW フレームの p90 が
+    予算 budget（秒）を超えたら1段下げ、予算の HEADROOM 倍に収まる状態が続いたら1段上げる。
+    上げた直後にまた下げた場合は、次に上げるまでの待ちを倍にして行ったり来たりを抑える。
+    """
+    # (render_scale に掛ける内部解像度の倍率, smoothscale で拡大するか)。
+    # smoothscale での拡大は最近傍の数倍かかるので、解像度より先に落とす
+    LEVELS = ((1.0, True), (1.0, False), (0.75, False), (0.5, False))
+    WINDOW = 30
+    HEADROOM = 0.6
+    DOWN_WAIT = 30        # 切り替えてから次に下げるまでのフレーム数
+    UP_WAIT = 180         # 切り替えてから次に上げるまでのフレーム数（初期値）
+    MAX_UP_WAIT = 3600
+
+    def __init__(self, render_scale=1.0, budget=SIM_DT, adaptive=False):
+        self.render_scale = render_scale
+        self.budget = budget
+        self.adaptive = adaptive
+        self.level = 0
+        self.changes = 0
+        self.frames_at = [0] * len(self.LEVELS)
+        self._times = collections.deque(maxlen=self.WINDOW)
+        self._age = 0
+        self._up_wait = self.UP_WAIT
+        self._raised = False
+
+    def quality(self):
+        """現在の (内部解像度の倍率, smoothscale で拡大するか)"""
+        scale, smooth = self.LEVELS[self.level]
+        return self.render_scale * scale, smooth
+
+    def update(self, seconds):
+        """1フレームの処理時間を記録し、必要なら品質を切り替える"""
+        self.frames_at[self.level] += 1
+        if not self.adaptive:
+            return
+        self._times.append(seconds)
+        self._age += 1
+        if len(self._times) < self.WINDOW:
+            return
+        busy = percentile(self._times, 90)
+        if busy > self.budget and self.level < len(self.LEVELS) - 1 and self._age >= self.DOWN_WAIT:
+            if self._raised:
+                self._up_wait = min(self._up_wait * 2, self.MAX_UP_WAIT)
+            self._switch(self.level + 1, raised=False)
+        elif busy < self.budget * self.HEADROOM and self.level > 0 and self._age >= self._up_wait:
+            self._switch(self.level - 1, raised=True)
+        elif self._raised and self._age >= self._up_wait:
+            # 上げた品質で落ち着いたら待ちを元に戻す
+            self._raised = False
+            self._up_wait = self.UP_WAIT
+
+    def _switch(self, level, raised):
+        self.level = level
+        self.changes += 1
+        self._raised = raised
+        self._times.clear()
+        self._age = 0
+
+    def stats(self):
+        levels = [(self.render_scale * scale, smooth, frames)
+                  for (scale, smooth), frames in zip(self.LEVELS, self.frames_at)]
+        return {"adaptive": self.adaptive, "changes": self.changes, "level": self.level, "levels": levels}
+
+# 描画クラス（内部解像度のサーフェースに描いてウィンドウの大きさに拡大する）
+class ScaledRenderer(FullRenderer):
+    """ゲームの座標は WIDTH x HEIGHT のまま、スプライトの画像と位置を内部解像度の倍率で縮めて描き、
+    ウィンドウの letterbox 領域に拡大する。HUD とプロファイラは拡大した後にウィンドウの解像度で重ねる。
+    内部解像度と拡大の方法は governor（QualityGovernor）が決める。
+    """
+    NAME = "scaled"
+
+    def __init__(self, game, governor):
+        super().__init__(game)
+        self.governor = governor
+        self.flip_time = 0.0      # 直前の画面への反映にかかった時間（秒）
+        self._canvases = {}       # 内部解像度 -> 描画先のサーフェース
+        self._images = {}         # (画像, 倍率) -> 縮めた画像
+        self._fonts = {}          # (TextCache, 倍率) -> ウィンドウの解像度に合わせた TextCache
+        self._target = None
+
+    def render(self, screen, alpha=1.0):
+        t = self.draw(screen, alpha)
+        pygame.display.flip()
+        self.flip_time = self.game.profiler.lap("flip", t) - t
+        self.frames += 1
+        self.pixels_pushed += screen.get_width() * screen.get_height()
+
+    def _canvas(self, size):
+        canvas = self._canvases.get(size)
+        if canvas is None:
+            canvas = self._canvases[size] = pygame.Surface(size).convert()
+        return canvas
+
+    def _scaled(self, image, scale):
+        key = (image, scale)
+        scaled = self._images.get(key)
+        if scaled is None:
+            scaled = self._images[key] = scale_image(image, scale)
+        return scaled
+
+    def _font(self, cache, k):
+        """HUD のフォントをウィンドウの倍率 k の大きさにしたもの"""
+        if k == 1.0:
+            return cache
+        key = (cache, k)
+        scaled = self._fonts.get(key)
+        if scaled is None:
+            size = next((size for size, font in _fonts.items() if font is cache.font), None)
+            scaled = self._fonts[key] = cache if size is None else TextCache(get_japanese_font(max(1, round(size * k))))
+        return scaled
+
+    def draw(self, surface, alpha=1.0):
+        sim = self.game.sim
+        profiler = self.game.profiler
+        t = profiler.clock()
+        alpha = self.interpolation(sim, alpha)
+        scale, smooth = self.governor.quality()
+        if surface is not self._target:
+            # letterbox の黒帯は描画先が変わったときだけ塗る
+            surface.fill(BLACK)
+            self._target = surface
+        area = letterbox(surface.get_size())
+        view = surface.subsurface(area)
+        size = (max(1, round(WIDTH * scale)), max(1, round(HEIGHT * scale)))
+        # 内部解像度がウィンドウの領域と同じなら直接描く
+        canvas = view if size == area.size else self._canvas(size)
+        profiler.count("render_pixels", size[0] * size[1])
+        canvas.fill(WHITE)
+
+        # 地面の描画
+        ground_y = round(sim.ground_y * scale)
+        pygame.draw.rect(canvas, GRAY, (0, ground_y, size[0], size[1] - ground_y))
+
+        if self.game.ghosts is not None:
+            self.game.ghosts.draw(canvas, alpha, scale)
+
+        # スプライトの描画（縮めた画像を縮めた位置にまとめて転送）
+        if scale == 1.0:
+            sequence = [(sprite.image, sprite.interpolated_pos(alpha)) for sprite in sim.all_sprites]
+        else:
+            sequence = []
+            for sprite in sim.all_sprites:
+                x, y = sprite.interpolated_pos(alpha)
+                sequence.append((self._scaled(sprite.image, scale), (round(x * scale), round(y * scale))))
+        canvas.blits(sequence, doreturn=False)
+        if canvas is not view:
+            (pygame.transform.smoothscale if smooth else pygame.transform.scale)(canvas, area.size, view)
+        t = profiler.lap("draw", t)
+
+        # スコアなどの表示（ウィンドウの解像度で描く）
+        k = area.width / WIDTH
+        for _, font, text, color, (x, y) in self.game.hud_items():
+            view.blit(self._font(font, k).render(text, True, color), (round(x * k), round(y * k)))
+        overlay = self.game.overlay
+        overlay.refresh()
+        if overlay.visible:
+            view.blit(overlay.image, (round(overlay.rect.right * k) - overlay.rect.width, round(overlay.rect.top * k)))
+        return profiler.lap("hud", t)
+
+    def stats(self):
+        """1フレームあたりの転送ピクセル数（比率はウィンドウ全体に対する値）"""
+        stats = super().stats()
+        size = self._target.get_size() if self._target is not None else (WIDTH, HEIGHT)
+        stats["full_redraw_ratio"] = stats["pixels_per_frame"] / (size[0] * size[1])
+        return stats
+
+# キー入力（動作名 -> キーの名前。pygame.key.name の名前で、--bind で変えられる）
+DEFAULT_KEYBINDINGS = {
+    "jump": ("space",),                          # 1人プレイと通信対戦の自分のバイク
+    "player1_jump": ("left meta", "right meta"),  # プレイヤー1（Cmdキー。1人プレイでも使える）
+    "player2_jump": ("left alt", "right alt"),    # 2人プレイのプレイヤー2（Optionキー）
+    "profiler": ("f3",),
+    "restart": ("r",),
+}
+JUMP_ACTIONS = ("jump", "player1_jump", "player2_jump")
+# HUD の操作説明に出すキーの表記（ここにないキーは名前を大文字にする）
+KEY_LABELS = {"left meta": "Cmd", "right meta": "Cmd", "left alt": "Option", "right alt": "Option"}
+
+class InputLayer:
+    """キー入力の受け付け
+
+    イベントキューは使うイベント（QUIT と KEYDOWN）だけに絞り、ジャンプの押下は時刻付きで溜める。
+    イベントには押した時刻がないので、前回キューを見た時刻（押したかもしれない最も早い時刻）を使う。
+    フレームの間の待ち時間は wait() でイベントが来るまで眠り、起きた時刻をそのイベントの時刻にする。
+    Game はティックごとに、そのティックが表す時間までに押されたものだけを取り出して適用する。
+    """
+    ALLOWED_EVENTS = (pygame.QUIT, pygame.KEYDOWN)
+
+    def __init__(self, keybindings=None):
+        self.keybindings = dict(DEFAULT_KEYBINDINGS, **(keybindings or {}))
+        self.actions = {}                      # キーコード -> 動作名（start で作る）
+        self.presses = collections.deque()     # (押した時刻, 動作名)
+        self.commands = []                     # ジャンプ以外の動作と "quit"
+        self._last_poll = None
+
+    def start(self):
+        """キーの名前を解決し、イベントキューを使うイベントだけに絞る（ウィンドウ作成後に呼ぶ）"""
+        self.actions = {}
+        for action, names in self.keybindings.items():
+            for name in names:
+                try:
+                    self.actions[pygame.key.key_code(name)] = action
+                except ValueError:
+                    raise SystemExit(f"unknown key name {name!r} for {action}")
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed(list(self.ALLOWED_EVENTS))
+
+    def poll(self):
+        """キューにあるイベントを受け取る"""
+        now = time.perf_counter()
+        pressed_at = now if self._last_poll is None else self._last_poll
+        self._last_poll = now
+        for event in pygame.event.get():
+            self._handle(event, pressed_at)
+
+    def _handle(self, event, pressed_at):
+        if event.type == pygame.QUIT:
+            self.commands.append("quit")
+        elif event.type == pygame.KEYDOWN:
+            action = self.actions.get(event.key)
+            if action in JUMP_ACTIONS:
+                self.presses.append((pressed_at, action))
+            elif action is not None:
+                self.commands.append(action)
+
+    def wait(self, deadline):
+        """deadline（perf_counter の時刻）まで、イベントを受け取りながら待つ
+
+        待ち時間は pygame.event.wait でイベントが来るまで眠る（細かく起きてキューを見に行かないので、
+        フレームの間に何もなければほとんど CPU を使わない）。
+        """
+        self.poll()
+        while True:
+            remaining = deadline - time.perf_counter()
+            timeout = int(remaining * 1000)
+            if timeout <= 0:
+                # 1 ms 未満の残りはそのまま眠る（pygame.event.wait はタイムアウト 0 だと無期限に待つ）
+                if remaining > 0:
+                    time.sleep(remaining)
+                self.poll()
+                return
+            event = pygame.event.wait(timeout)
+            now = time.perf_counter()
+            self._last_poll = now
+            if event.type != pygame.NOEVENT:
+                self._handle(event, now)
+
+    def take_commands(self):
+        commands = self.commands
+        self.commands = []
+        return commands
+
+    def take_presses(self, until):
+        """until までに押されたジャンプを (押した時刻, 動作名) の一覧で取り出す"""
+        presses = []
+        while self.presses and self.presses[0][0] <= until:
+            presses.append(self.presses.popleft())
+        return presses
+
+    def label(self, action):
+        """HUD に出す action のキーの表記"""
+        name = self.keybindings[action][0]
+        return KEY_LABELS.get(name, name.upper())
+
+# ゲームクラス
+class Game:
+    def __init__(self, game_mode, dirty=False, max_fps=60, profile_path=None, seed=None,
+                 replay=None, record_path=None, session=None, autopilot=None, ghosts=None, track=None,
+                 render_scale=1.0, adaptive=False, frame_budget=None, keybindings=None):
+        self.game_mode = game_mode
+        # リプレイの再生中はキー入力の代わりにリプレイの入力でシミュレーションを進める
+        self.replay = replay
+        # 通信対戦では session（bike_net.NetPeer）がロールバック込みでシミュレーションを進める
+        self.session = session
+        if session is not None:
+            self.sim = session.sim
+        elif replay is not None:
+            self.sim = Simulation(replay.game_mode, replay.seed, replay.rules, track)
+        else:
+            # 固定コース（track）を走るときはコースのルールで遊ぶ
+            self.sim = Simulation(game_mode, seed, track.rules if track is not None else None, track)
+        self.record_path = record_path
+        self.recording = Replay.start(self.sim) if record_path else None
+        # autopilot（Autopilot）が操作するバイクの入力はキー入力に重ねる
+        self.autopilot = autopilot
+        # ゴースト（bike_ghost.GhostPack）はティックごとに進め、全画面描画のときに描く
+        self.ghosts = ghosts
+        # フレームの処理時間は常に計測し、F3 で表示、profile_path があれば終了時に書き出す
+        self.profiler = FrameProfiler(keep_records=bool(profile_path))
+        self.sim.profiler = self.profiler
+        self.overlay = ProfilerOverlay(self.profiler)
+        self.profile_path = profile_path
+        self.font = TextCache(get_japanese_font(36))
+        self.small_font = TextCache(get_japanese_font(24))
+        self.dirty = dirty
+        self.max_fps = max_fps  # 0 なら上限なし（垂直同期時など）
+        # 内部解像度（WIDTH x HEIGHT に対する倍率）と、処理時間に合わせて品質を変えるか
+        self.render_scale = render_scale
+        self.adaptive = adaptive
+        # 1フレームの処理時間の予算（秒、省略時は描画の上限フレームレートの1フレーム分）
+        self.frame_budget = frame_budget or (1.0 / max_fps if max_fps else SIM_DT)
+        self.governor = None
+        self.renderer = None
+        # キー入力（keybindings は動作名 -> キーの名前の一覧で、DEFAULT_KEYBINDINGS の一部を上書きする）
+        self.input = InputLayer(keybindings)
+        self.shown_presses = []   # ティックに適用済みで、まだ画面に出ていない押下の時刻
+
+    def handle_commands(self):
+        """ジャンプ以外のキー入力を処理する（Rキーでのリスタート時は True を返す）"""
+        for command in self.input.take_commands():
+            if command == "quit":
+                self.report()
+                pygame.quit()
+                sys.exit()
+            if command == "profiler":
+                self.overlay.toggle()
+            elif command == "restart" and (self.sim.game_over or self.replay_finished()):
+                # ゲームリセット（バイク選択画面に戻る）
+                self.report()
+                return True
         return False
 
+    def jump_inputs(self, presses):
+        """押下の一覧をバイクごとのジャンプ入力と、バイクに割り当てられた押下の時刻にする"""
+        inputs = [False] * len(self.sim.bikes)
+        applied = []
+        if self.replay is not None:
+            return inputs, applied
+        for pressed_at, action in presses:
+            if self.session is not None:
+                index = self.session.local if action == "jump" else None
+            elif self.game_mode == "single":
+                # 1人プレイでは Cmd キー（プレイヤー1のキー）でもジャンプする
+                index = 0 if action in ("jump", "player1_jump") else None
+            else:
+                # 2人プレイの場合のキー入力
+                index = {"player1_jump": 0, "player2_jump": 1}.get(action)
+            if index is not None and index < len(inputs):
+                inputs[index] = True
+                applied.append(pressed_at)
+        return inputs, applied
+
+    def replay_finished(self):
+        return self.replay is not None and self.sim.frame >= self.replay.final_frame
+
+    def step(self, inputs, pressed_at=()):
+        """1ティック進める（リプレイの再生・記録もここで行う）
+
+        pressed_at は inputs のジャンプのキーを押した時刻で、ジャンプするまでの遅れを計測する。
+        """
+        sim = self.sim
+        if self.autopilot is not None and self.replay is None:
+            t = self.profiler.clock()
+            inputs = [pressed or bot for pressed, bot in zip(inputs, self.autopilot(sim.get_state()))]
+            self.profiler.count("bot_nodes", self.autopilot.nodes_last)
+            self.profiler.lap("bot", t)
+        if pressed_at:
+            # このティックの最初に jump() が呼ばれる
+            now = time.perf_counter()
+            for t in pressed_at:
+                self.profiler.latency("jump", now - t)
+            self.shown_presses.extend(pressed_at)
+        if self.session is not None:
+            self.session.advance(inputs[self.session.local])
+            return
+        if self.replay is not None:
+            if self.replay_finished():
+                return
+            inputs = self.replay.inputs_at(sim.frame)
+        elif self.recording is not None and not sim.game_over:
+            self.recording.record(sim.frame, inputs)
+        frame = sim.frame
+        sim.step(inputs)
+        if self.ghosts is not None and sim.frame != frame:
+            t = self.profiler.clock()
+            self.ghosts.step(sim, frame)
+            self.profiler.lap("bike_update", t)
+        if self.replay_finished():
+            match = sim.checksum() == self.replay.checksum
+            print(f"Replay finished at tick {sim.frame}: checksum {sim.checksum():08x} "
+                  f"({'OK' if match else 'MISMATCH'})")
+
+    def bot_controls(self, index):
+        """index 番目のバイクを autopilot が操作しているか"""
+        return self.autopilot is not None and (self.autopilot.players is None or index in self.autopilot.players)
+
+    def hud_items(self):
+        """HUD に表示する (名前, フォント, 文字列, 色, 位置) の一覧"""
+        sim = self.sim
+        # スコアと難易度の表示
+        items = [
+            ("score", self.font, f"Score: {int(sim.score)}", BLACK, (10, 10)),
+            ("level", self.font, f"Level: {sim.difficulty}", BLACK, (10, 50)),
+        ]
+
+        # プレイヤー状態の表示
+        if self.game_mode == "two_player":
+            names = [f"Player{i + 1}" + (" (CPU)" if self.bot_controls(i) else "") for i in range(2)]
+            player1_status = f"{names[0]}: " + ("CRASHED" if sim.bike1.crashed else "OK")
+            player2_status = f"{names[1]}: " + ("CRASHED" if sim.bike2.crashed else "OK")
+
+            player1_color = RED if sim.bike1.crashed else GREEN
+            player2_color = RED if sim.bike2.crashed else GREEN
+
+            items.append(("player1", self.small_font, player1_status, player1_color, (WIDTH - 200, 10)))
+            items.append(("player2", self.small_font, player2_status, player2_color, (WIDTH - 200, 35)))
+
+        if self.session is not None:
+            items.append(("net", self.small_font, self.session.status(), BLACK, (WIDTH // 2 - 150, 10)))
+        if self.ghosts is not None:
+            items.append(("ghosts", self.small_font, self.ghosts.status(sim), BLACK, (WIDTH // 2 - 150, 10)))
+
+        # 操作説明
+        if sim.score < 50:
+            label = self.input.label
+            if self.session is not None:
+                items.append(("instruction1", self.small_font,
+                              f"Player{self.session.local + 1}: {label('jump')} to jump!", BLACK, (10, 90)))
+            elif self.game_mode == "single":
+                items.append(("instruction1", self.small_font, f"{label('jump')} to jump!", BLACK, (10, 90)))
+            else:
+                items.append(("instruction1", self.small_font, f"Player1: {label('player1_jump')} to jump!",
+                              BLACK, (10, 90)))
+                items.append(("instruction2", self.small_font, f"Player2: {label('player2_jump')} to jump!",
+                              BLACK, (10, 115)))
+
+        if self.replay is not None:
+            items.append(("replay", self.small_font, f"REPLAY {sim.frame}/{self.replay.final_frame}", RED,
+                          (WIDTH // 2 - 80, 10)))
+
+        # ゲームオーバー表示
+        if sim.game_over or self.replay_finished():
+            items.append(("game_over", self.font, "GAME OVER - Press R to restart", BLACK,
+                          (WIDTH // 2 - 180, HEIGHT // 2)))
+        return items
+
+    def report(self):
+        """描画の統計（1フレームあたりの転送ピクセル数）を表示し、トレースとリプレイを書き出す"""
+        if self.renderer is None or not self.renderer.frames:
+            return
+        if self.recording is not None:
+            self.recording.finish(self.sim)
+            self.recording.save(self.record_path)
+            print(f"Replay: seed {self.recording.seed}, {self.recording.final_frame} ticks, "
+                  f"checksum {self.recording.checksum:08x} -> {self.record_path}")
+        summary = self.profiler.summary()
+        if self.profile_path:
+            self.profiler.export(self.profile_path)
+            print(f"Profile: {summary['frames']} frames, p50 {summary['frame_ms_p50']:.2f} ms, "
+                  f"p99 {summary['frame_ms_p99']:.2f} ms -> {self.profile_path}")
+        if self.profiler.latencies["jump"]:
+            print(f"Input latency: press to jump p50 {summary['press_to_jump_ms_p50']:.1f} ms, "
+                  f"p99 {summary['press_to_jump_ms_p99']:.1f} ms; "
+                  f"press to flip p50 {summary['press_to_flip_ms_p50']:.1f} ms, "
+                  f"p99 {summary['press_to_flip_ms_p99']:.1f} ms")
+        if self.autopilot is not None:
+            stats = self.autopilot.stats()
+            print(f"Autopilot: {stats['decisions']} decisions, {stats['nodes_per_decision']:.0f} nodes/decision, "
+                  f"plan p99 {stats['plan_ms_p99']:.2f} ms, {stats['timeouts']} timeouts")
+        stats = self.renderer.stats()
+        print(f"Renderer ({self.renderer.NAME}): {stats['frames']} frames, "
+              f"{stats['pixels_per_frame']:.0f} px/frame "
+              f"({stats['full_redraw_ratio'] * 100:.1f}% of full redraw)")
+        if self.governor is not None:
+            stats = self.governor.stats()
+            levels = ", ".join(f"{scale:.2f}x{' smooth' if smooth else ''} {frames}"
+                               for scale, smooth, frames in stats["levels"] if frames)
+            print(f"Quality ({'adaptive' if stats['adaptive'] else 'fixed'}): {stats['changes']} changes, "
+                  f"frames per level: {levels}")
+
+    def start(self):
+        """ウィンドウと描画の準備をする（run_frame の前に1度だけ呼ぶ）"""
+        self.screen = get_screen()
+        if self.screen.get_size() != (WIDTH, HEIGHT) or self.render_scale != 1.0 or self.adaptive:
+            # ウィンドウの大きさや内部解像度が WIDTH x HEIGHT と違うときは拡大して描く（差分描画とは併用できない）
+            self.governor = QualityGovernor(self.render_scale, self.frame_budget, self.adaptive)
+            self.renderer = ScaledRenderer(self, self.governor)
+        elif self.dirty and self.ghosts is None:
+            self.renderer = DirtyRenderer(self)
+        else:
+            # ゴーストは画面全体を動き回るので全画面描画で描く
+            self.renderer = FullRenderer(self)
+        # ウィンドウ作成後に表示形式のテクスチャと、その衝突判定用のマスクを用意しておく
+        textures.warm()
+        masks.warm()
+        self.input.start()
+        # シミュレーションは SIM_HZ の固定タイムステップで進め、描画は表示できるだけ行う
+        self.accumulator = 0.0
+        self.previous = time.perf_counter()
+
+    def run_frame(self):
+        """1フレーム分の入力・ティック・描画を行う（Rキーでのリスタート時は True を返す）"""
+        now = time.perf_counter()
+        self.accumulator += min(now - self.previous, MAX_FRAME_TIME)
+        self.previous = now
+
+        # イベント処理
+        t = self.profiler.clock()
+        self.input.poll()
+        if self.handle_commands():
+            return True
+        self.profiler.lap("events", t)
+
+        # このフレームで進めるティックは、それぞれ tick_end までの時間を表す。ジャンプはそのティックの
+        # 時間内に押されたものだけを適用し、まだ来ていない時間に押されたものは次のフレームに持ち越す
+        tick_end = now - self.accumulator
+        while self.accumulator >= SIM_DT:
+            tick_end += SIM_DT
+            inputs, pressed_at = self.jump_inputs(self.input.take_presses(tick_end))
+            self.step(inputs, pressed_at)
+            self.accumulator -= SIM_DT
+            self.profiler.ticks += 1
+
+        # 描画（前のティックとの間を補間）
+        self.renderer.render(self.screen, self.accumulator / SIM_DT)
+        if self.shown_presses:
+            # ジャンプが画面に出るまでの遅れ（flip した時点まで）
+            now = time.perf_counter()
+            for pressed_at in self.shown_presses:
+                self.profiler.latency("flip", now - pressed_at)
+            self.shown_presses = []
+        if self.governor is not None:
+            # 画面への反映（垂直同期の待ち）を除いた処理時間で描画の品質を決める
+            self.governor.update(time.perf_counter() - self.previous - self.renderer.flip_time)
+        report_startup()
+        self.profiler.end_frame(len(self.sim.all_sprites))
+        # 画面を出した後の空き時間に数秒先のコースの区間を用意しておく（ティックの中で作らずに済む）
+        self.sim.course.prefetch(self.sim.frame)
+        return None
+
+    def run(self):
+        self.start()
+        next_frame = time.perf_counter()
+        while True:
+            restart = self.run_frame()
+            if restart is not None:
+                return restart
+            if self.max_fps:
+                # 次のフレームまでの待ち時間もキー入力を受け取り、押した時刻を記録する
+                next_frame = max(next_frame + 1 / self.max_fps, time.perf_counter())
+                self.input.wait(next_frame)
+
+# 反射ボットがジャンプする障害物までの距離の既定値。90 ではほぼ全ゲームがスコア 2800〜2950 で終わり、
+# スコアの分布がつぶれる（バランス調整で差が見えない）。スコア 2800 を超えると障害物の生成間隔（下限で 41 ティック）が
+# ジャンプの滞空時間（約 45 ティック）より短くなり、反射ボットでは避けきれなくなるため
+REFLEX_LOOKAHEAD = 45
+
+def reflex_policy(state, lookahead=REFLEX_LOOKAHEAD):
+    """目の前に障害物が来たらジャンプするだけの簡単なボット（状態辞書 -> ジャンプ入力）"""
+    inputs = []
+    for bike in state["bikes"]:
+        front = bike["x"] + bike["width"]
+        inputs.append(any(0 <= x - front <= lookahead for _, x, _, _, _ in state["obstacles"]))
+    return inputs
+
+def round_half_away(value):
+    """pygame.Rect に小数を代入したときと同じ丸め（0.5 は 0 から遠い方へ）"""
+    return int(value + 0.5) if value >= 0 else -int(0.5 - value)
+
+class _OutOfTime(Exception):
+    pass
+
+class Autopilot:
+    """先の展開をシミュレーションしてジャンプするかを決めるボット（状態辞書 -> ジャンプ入力）
+
+    get_state() の状態（タプルだけの軽い複製）から、見えている障害物と坂の動きとバイクの物理を
+    horizon ティック先まで再現し、ジャンプしない・するの両方を深さ優先で探す。どちらでも生き残れるなら
+    ジャンプを遅らせる。障害物も坂も画面右端から現れるので、horizon が右端からバイクまで流れてくる時間
+    （約 180 ティック）より短ければ、まだ出現していないものを知らなくても読み切れる。
+    探索が1回あたり budget 秒を超えたら打ち切り、反射ボットと同じ判定にする。
+    状態はタプルだけなので、探索を別スレッドや別プロセスに渡すこともできる。
+    """
+    def __init__(self, players=None, rules=None, horizon=120, budget=0.002, lookahead=90):
+        self.players = players  # 操作するバイクの番号（None なら全員）
+        rules = dict(DEFAULT_RULES, **(rules or {}))
+        self.gravity = rules["gravity"]
+        self.jump_velocity = rules["jump_velocity"]
+        self.horizon = horizon
+        self.budget = budget
+        self.lookahead = lookahead
+        # 統計
+        self.decisions = 0
+        self.nodes = 0        # これまでに展開した状態の数
+        self.nodes_last = 0   # 直前の呼び出しで展開した状態の数
+        self.timeouts = 0
+        self.surprises = 0    # 生き残れると判断したのにクラッシュした回数（0 でなければ物理の再現がずれている）
+        self.latencies = collections.deque(maxlen=3600)
+        self._safe = {}
+        # バイクごとの「ここからは必ずクラッシュする」状態（ゲーム内の絶対ティック -> 状態の集合）。
+        # 障害物は増えることはあっても手前で消えることはないので、次のティックの探索でもそのまま使える
+        self._failures = {}
+
+    def __call__(self, state):
+        self.nodes_last = 0
+        if state["frame"] == 0:
+            self._safe.clear()
+            self._failures.clear()
+        inputs = []
+        for i, bike in enumerate(state["bikes"]):
+            if self._safe.get(i) and bike["crashed"]:
+                self.surprises += 1
+            if bike["crashed"] or (self.players is not None and i not in self.players):
+                self._safe[i] = False
+                inputs.append(False)
+            else:
+                inputs.append(self.decide(i, bike, state))
+        self.nodes += self.nodes_last
+        return inputs
+
+    def decide(self, i, bike, state):
+        """i 番目のバイクをこのティックにジャンプさせるか"""
+        if bike["jumping"]:
+            return False  # 空中ではできることがない
+        start = time.perf_counter()
+        self._deadline = start + self.budget
+        frame = state["frame"]
+        failures = self._failures.get(i)
+        if failures is None or failures["frame"] > frame:
+            # 最初の判断か、ロールバックなどで時間が戻ったときは作り直す
+            failures = self._failures[i] = {"frame": frame, "ticks": {}}
+        for old in range(failures["frame"], frame):
+            failures["ticks"].pop(old, None)
+        failures["frame"] = frame
+        self._frame = frame
+        self._failed = failures["ticks"]
+        self._bike = (bike["x"], bike["width"], bike["height"], bike["x"] + bike["width"] // 2)
+        # 衝突判定は Simulation.step と同じくキャッシュしたマスクと坂のめり込みの表で行う
+        image = assets.get(bike["bike_type"])
+        self._bike_mask = masks.get(image)
+        self._clearance = {up: masks.clearance(image, textures.get(slope_type, Slope.WIDTH, Slope.HEIGHT))
+                           for up, slope_type in ((True, "up"), (False, "down"))}
+        # 通り過ぎたものは除き、障害物は (左, 上, 右, 下, マスク)、坂は (左, 上り坂か, 上端) にしておく
+        self._obstacles = [(x, y, x + w, y + h, masks.get(textures.get(obstacle_type, w, h)))
+                           for obstacle_type, x, y, w, h in state["obstacles"] if x + w > bike["x"]]
+        self._slopes = [(x, slope_type == "up", y) for slope_type, x, y in state["slopes"]
+                        if x + Slope.WIDTH > bike["x"]]
+        y, velocity_y = bike["y"], bike["velocity_y"]
+        try:
+            if self._search_action(0, y, velocity_y, False, False):
+                jump, safe = False, True
+            elif self._search_action(0, y, velocity_y, False, True):
+                jump, safe = True, True
+            else:
+                # どうしても避けられないときはとりあえずジャンプする
+                jump, safe = True, False
+        except _OutOfTime:
+            self.timeouts += 1
+            front = bike["x"] + bike["width"]
+            jump = any(0 <= x - front <= self.lookahead for _, x, _, _, _ in state["obstacles"])
+            safe = False
+        self._safe[i] = safe
+        self.decisions += 1
+        self.latencies.append(time.perf_counter() - start)
+        return jump
+
+    def _search_action(self, t, y, velocity_y, jumping, jump):
+        """ティック t に jump して、その先 horizon まで生き残る入力の列があるか"""
+        result = self._step(t, y, velocity_y, jumping, jump)
+        return result is not None and self._search(t + 1, *result)
+
+    def _search(self, t, y, velocity_y, jumping):
+        if t >= self.horizon:
+            return True
+        key = (y, velocity_y, jumping)
+        failed = self._failed.get(self._frame + t)
+        if failed is not None and key in failed:
+            return False
+        self.nodes_last += 1
+        if self.nodes_last & 63 == 0 and time.perf_counter() > self._deadline:
+            raise _OutOfTime
+        if self._search_action(t, y, velocity_y, jumping, False):
+            return True
+        if not jumping and self._search_action(t, y, velocity_y, jumping, True):
+            return True
+        self._failed.setdefault(self._frame + t, set()).add(key)
+        return False
+
+    def _step(self, t, y, velocity_y, jumping, jump):
+        """Simulation.step のバイク1台分を再現する（クラッシュしたら None）"""
+        if jump and not jumping:
+            velocity_y = self.jump_velocity
+            jumping = True
+        velocity_y += self.gravity
+        y = round_half_away(y + velocity_y)
+
+        bike_x, bike_width, bike_height, center_x = self._bike
+        ground_y = HEIGHT - 140 - 40
+        # バイクの更新は坂が動く前の位置で行われる
+        scroll = SCROLL_SPEED * t
+        for slope_x, up, slope_y in self._slopes:
+            relative_x = center_x - (slope_x - scroll)
+            if 0 <= relative_x <= Slope.WIDTH:
+                slope_height = (relative_x / Slope.WIDTH) * Slope.HEIGHT
+                if up:
+                    ground_y = slope_y + Slope.HEIGHT - slope_height - bike_height
+                else:
+                    ground_y = slope_y + slope_height - bike_height
+                break
+        if y >= ground_y:
+            y = round_half_away(ground_y)
+            velocity_y = 0
+            jumping = False
+
+        # 坂にめり込んでいたら押し上げる（Bike._rest_on_slopes と同じ）
+        lift = 0
+        for slope_x, up, slope_y in self._slopes:
+            left = slope_x - scroll
+            if (left < bike_x + bike_width and bike_x < left + Slope.WIDTH
+                    and y < slope_y + Slope.HEIGHT and slope_y < y + bike_height):
+                depth = self._clearance[up][bike_x - left + bike_width - 1]
+                if depth is not None:
+                    lift = max(lift, y - slope_y + depth + 1)
+        if lift > 0:
+            y -= lift
+            if velocity_y >= 0:
+                velocity_y = 0
+                jumping = False
+
+        # 衝突判定は障害物が動いた後の位置で行われる
+        scroll += SCROLL_SPEED
+        for left, top, right, bottom, mask in self._obstacles:
+            if left - scroll < bike_x + bike_width and bike_x < right - scroll and y < bottom and top < y + bike_height:
+                if self._bike_mask.overlap(mask, (left - scroll - bike_x, top - y)):
+                    return None
+        return y, velocity_y, jumping
+
+    def stats(self):
+        latencies = [seconds * 1000 for seconds in self.latencies]
+        return {
+            "decisions": self.decisions,
+            "nodes": self.nodes,
+            "nodes_per_decision": self.nodes / self.decisions if self.decisions else 0.0,
+            "plan_ms_p50": percentile(latencies, 50),
+            "plan_ms_p99": percentile(latencies, 99),
+            "plan_ms_max": max(latencies, default=0.0),
+            "timeouts": self.timeouts,
+            "surprises": self.surprises,
+        }
+
+def run_headless(game_mode="single", steps=36000, seed=None, policy=None, track=None):
+    """描画なしで指定ステップ数だけシミュレーションを回し、結果を返す
+
+    policy は状態辞書を受け取ってバイクごとのジャンプ入力を返す関数。
+    ゲームオーバーになったら次のシードでリセットして続行する（固定コース track なら同じコースを走り直す）。
+    """
+    sim = Simulation(game_mode, seed, track.rules if track is not None else None, track)
+    state = sim.get_state()
+    scores = []
+    start = time.perf_counter()
+
+    for _ in range(steps):
+        inputs = policy(state) if policy else ()
+        state = sim.step(inputs)
+        if state["game_over"]:
+            scores.append(state["score"])
+            seed = None if seed is None else seed + 1
+            state = sim.reset(seed)
+
+    elapsed = time.perf_counter() - start
+    return {
+        "steps": steps,
+        "elapsed": elapsed,
+        "steps_per_sec": steps / elapsed if elapsed > 0 else float("inf"),
+        "games": len(scores),
+        "scores": scores,
+    }
+
+def window_size(text):
+    """--window の "幅x高さ" を (幅, 高さ) にする"""
+    try:
+        width, height = (int(value) for value in text.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {text!r}")
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError(f"window size must be positive, got {text!r}")
+    return width, height
+
+def seed_value(text):
+    """--seed の値（リプレイのヘッダーに 64 ビットの符号なし整数で書くので、その範囲に限る）"""
+    try:
+        seed = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected an integer, got {text!r}")
+    if not 0 <= seed < 2 ** 64:
+        raise argparse.ArgumentTypeError(f"seed must be between 0 and 2**64 - 1, got {text!r}")
+    return seed
+
+def key_binding(text):
+    """--bind の "動作=キー[,キー...]" を (動作, キーの名前のタプル) にする"""
+    action, _, keys = text.partition("=")
+    if action not in DEFAULT_KEYBINDINGS or not keys:
+        raise argparse.ArgumentTypeError(f"expected ACTION=KEY[,KEY...] with ACTION one of "
+                                         f"{', '.join(DEFAULT_KEYBINDINGS)}, got {text!r}")
+    return action, tuple(key.strip() for key in keys.split(","))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="バイクゲーム")
+    parser.add_argument("--headless", action="store_true", help="ウィンドウを開かずにシミュレーションだけを実行")
+    parser.add_argument("--mode", choices=["single", "two_player"], default="single", help="ヘッドレス実行時のプレイモード")
+    parser.add_argument("--steps", type=int, default=36000, help="ヘッドレス実行時のステップ数")
+    parser.add_argument("--seed", type=seed_value, default=None, help="乱数シード")
+    parser.add_argument("--bot", nargs="?", const="reflex", choices=["reflex", "autopilot"],
+                        help="ヘッドレス実行時にボットでジャンプさせる（reflex: 反射ボット / autopilot: 先読みボット）")
+    parser.add_argument("--autopilot", type=int, action="append", metavar="PLAYER",
+                        help="先読みボットに操作させるプレイヤー番号（2人プレイの対戦相手なら 2、複数指定可）")
+    parser.add_argument("--bot-budget", type=float, default=2.0, help="先読みボットの1回あたりの探索時間の上限（ms）")
+    parser.add_argument("--dirty", action="store_true", help="変化した部分だけを画面に反映する描画モード")
+    parser.add_argument("--fps", type=int, default=60, help="描画フレームレートの上限（0 で上限なし）")
+    parser.add_argument("--vsync", action="store_true", help="垂直同期に合わせて描画（フレームレート上限なし）")
+    parser.add_argument("--window", type=window_size, metavar="WxH", help="ウィンドウの大きさ（例: 1920x1080）")
+    parser.add_argument("--fullscreen", action="store_true", help="画面全体に表示")
+    parser.add_argument("--scaled", action="store_true",
+                        help="ウィンドウへの拡大を SDL（SCALED）に任せる（描画は WIDTH x HEIGHT 以下で行う）")
+    parser.add_argument("--render-scale", type=float, default=1.0,
+                        help="内部解像度（1200x800 に対する倍率、--adaptive のときは上限）")
+    parser.add_argument("--adaptive", action="store_true", help="処理時間に合わせて内部解像度と拡大の方法を切り替える")
+    parser.add_argument("--frame-budget", type=float, metavar="MS",
+                        help="--adaptive の1フレームの処理時間の予算（ms、省略時は --fps の1フレーム分）")
+    parser.add_argument("--profile", metavar="FILE", help="フレームごとの処理時間を書き出すファイル（.json または .csv）")
+    parser.add_argument("--bind", type=key_binding, action="append", default=[], metavar="ACTION=KEY[,KEY]",
+                        help="キー割り当てを変える（例: --bind jump=up,w --bind 'player2_jump=right shift'、"
+                             f"動作は {', '.join(DEFAULT_KEYBINDINGS)}）")
+    parser.add_argument("--record", metavar="FILE", help="プレイしたゲームをリプレイとして書き出すファイル")
+    parser.add_argument("--replay", metavar="FILE", help="リプレイを再生する（--headless と一緒なら最高速で再生して照合）")
+    parser.add_argument("--course", metavar="FILE", help="固定コース（--save-course で書き出したもの）を走る")
+    parser.add_argument("--save-course", metavar="FILE", help="--seed（または --course）のコースを固定コースとして書き出す")
+    parser.add_argument("--course-seconds", type=int, default=120, help="--save-course で書き出すコースの長さ（秒）")
+    return parser.parse_args(argv)
+
+mark_startup("import")
+
 # メインループ
-if __name__ == "__main__":
+def main(argv=None):
+    args = parse_args(argv)
+
+    try:
+        replay = Replay.load(args.replay) if args.replay else None
+    except ValueError as e:
+        raise SystemExit(f"{args.replay}: {e}")
+    track = Course.load(args.course) if args.course else None
+
+    if args.save_course:
+        if track is not None:
+            course = track.restarted()
+        else:
+            course = Course(random.randrange(2 ** 32) if args.seed is None else args.seed)
+        course.save(args.save_course, args.course_seconds * SIM_HZ)
+        print(f"Saved {args.course_seconds} s of course seed {course.seed} to {args.save_course}")
+        return
+
+    if args.headless and replay is not None:
+        result = play_replay(replay, track)
+        print(f"Replayed {result['frames']} ticks in {result['elapsed']:.3f}s "
+              f"({result['frames'] / max(result['elapsed'], 1e-9):.0f} ticks/sec), "
+              f"checksum {result['checksum']:08x} ({'OK' if result['match'] else 'MISMATCH'})")
+        if not result["match"]:
+            sys.exit(1)
+        return
+
+    if args.headless:
+        autopilot = Autopilot(budget=args.bot_budget / 1000) if args.bot == "autopilot" else None
+        policy = autopilot or (reflex_policy if args.bot else None)
+        result = run_headless(args.mode, args.steps, args.seed, policy, track)
+        print(f"{result['steps']} steps in {result['elapsed']:.2f}s "
+              f"({result['steps_per_sec']:.0f} steps/sec), {result['games']} games finished")
+        if autopilot is not None:
+            # 長時間回すと、物理の再現のずれ（surprises）や探索の打ち切りの回数が分かる
+            stats = autopilot.stats()
+            print(f"Autopilot: {stats['decisions']} decisions, {stats['nodes_per_decision']:.0f} nodes/decision, "
+                  f"plan p50 {stats['plan_ms_p50']:.2f} ms, p99 {stats['plan_ms_p99']:.2f} ms, "
+                  f"max {stats['plan_ms_max']:.2f} ms, {stats['timeouts']} timeouts, {stats['surprises']} surprises")
+            if stats["surprises"]:
+                sys.exit(1)
+        return
+
+    if args.render_scale <= 0:
+        raise SystemExit(f"--render-scale must be positive, got {args.render_scale}")
+    # 垂直同期やウィンドウの大きさはウィンドウ作成時に指定する必要がある
+    get_screen(vsync=args.vsync, window=args.window, fullscreen=args.fullscreen, scaled=args.scaled)
+    prepare_assets()
+    max_fps = 0 if args.vsync else args.fps
+    options = {"render_scale": args.render_scale, "adaptive": args.adaptive,
+               "frame_budget": args.frame_budget / 1000 if args.frame_budget else None, "keybindings": dict(args.bind)}
+
+    if replay is not None:
+        # リプレイは通常の速度で再生する
+        Game(replay.game_mode, dirty=args.dirty, max_fps=max_fps, profile_path=args.profile, replay=replay,
+             track=track, **options).run()
+        return
+
     restart = True
     
     while restart:
@@ -512,5 +2794,12 @@ if __name__ == "__main__":
         selected_mode = bike_selection.run()
         
         # ゲーム開始
-        game = Game(selected_mode)
+        autopilot = None
+        if args.autopilot:
+            autopilot = Autopilot([player - 1 for player in args.autopilot], budget=args.bot_budget / 1000)
+        game = Game(selected_mode, dirty=args.dirty, max_fps=max_fps, profile_path=args.profile,
+                    seed=args.seed, record_path=args.record, autopilot=autopilot, track=track, **options)
         restart = game.run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""ゴーストレース
+
+プレイヤーと同じコース（同じシード）を、記録したリプレイやボットが操作する多数のバイク（ゴースト）と一緒に走る。
+ゴーストはゲームに影響しない。1台ずつのスプライトではなく NumPy 配列で持ち、重力・坂の地面・障害物との
+衝突の判定（Simulation と同じマスクによる精密判定）を全ゴーストまとめて行う。描画は共有の半透明画像を1回の Surface.fblits でまとめて転送する。
+
+最後まで生き残った順位を競う（クラッシュしたゴーストは後ろに流れて消える）。
+
+    python bike_ghost.py --ghosts 256
+    python bike_game.py --seed 42 --record run1.bkrp
+    python bike_ghost.py --replay run1.bkrp --replay run2.bkrp --ghosts 64
+"""
+import argparse
+import random
+import sys
+
+import numpy as np
+import pygame
+
+from bike_batch import GROUND_Y, clearance_tables, opaque_in, round_half_away, slope_lift, summed_mask
+from bike_game import (HEIGHT, SCROLL_SPEED, DEFAULT_RULES, Autopilot, Game, Replay, Slope, assets, get_screen,
+                       prepare_assets, scale_image, seed_value)
+
+BIKE_GROUND_Y = HEIGHT - 140 - 40
+
+class GhostPack:
+    """ゴーストの集まり
+
+    replays の各リプレイ（プレイヤー1の入力）で走るゴーストと、反射ボット（ゴーストごとに x 位置と
+    ジャンプする距離が違う）で走る count 台のゴーストからなる。リプレイのゴーストはプレイヤーと同じ位置を走る。
+    """
+    def __init__(self, count=0, replays=(), seed=0, rules=None):
+        rules = dict(DEFAULT_RULES, **(rules or {}))
+        self.gravity = rules["gravity"]
+        self.jump_velocity = rules["jump_velocity"]
+        self.replays = list(replays)
+        rng = random.Random(seed)
+        n = len(self.replays) + count
+        self.count = n
+        self.x = np.array([80] * len(self.replays) + [rng.randrange(20, 420) for _ in range(count)], dtype=np.int64)
+        self.lookahead = np.array([0] * len(self.replays) + [rng.randrange(40, 140) for _ in range(count)],
+                                  dtype=np.int64)
+        self.is_bot = np.arange(n) >= len(self.replays)
+
+        # 画像は種類ごとに共有する（0, 1: bike1 の通常・クラッシュ、2, 3: bike2）
+        kinds = ["bike1"] * len(self.replays) + [rng.choice(["bike1", "bike2"]) for _ in range(count)]
+        self.kind = np.array([0 if kind == "bike1" else 2 for kind in kinds], dtype=np.int64)
+        width, height = assets.get("bike1").get_size()
+        self.width = width
+        self.height = height
+        self.center_x = self.x + width // 2
+        # 精密な衝突判定に使う表（種類ごと）
+        self.depths = {kind: clearance_tables(assets.get(name)) for kind, name in ((0, "bike1"), (2, "bike2"))}
+        self.summed_masks = {kind: summed_mask(assets.get(name)) for kind, name in ((0, "bike1"), (2, "bike2"))}
+        self._images = None
+        self._scaled_images = {}   # 内部解像度の倍率 -> 縮めた画像（ScaledRenderer 用）
+        self.reset()
+
+    def reset(self):
+        n = self.count
+        self.y = np.full(n, BIKE_GROUND_Y, dtype=np.int64)
+        self.prev_y = self.y.copy()
+        self.velocity_y = np.zeros(n)
+        self.jumping = np.zeros(n, dtype=bool)
+        self.crashed = np.zeros(n, dtype=bool)
+        self.crash_frame = np.full(n, np.iinfo(np.int64).max, dtype=np.int64)
+        self.draw_x = self.x.copy()
+
+    def images(self, scale=1.0):
+        """種類ごとの半透明画像（ウィンドウ作成後に変換済みのものを取得する）"""
+        if self._images is None:
+            self._images = [assets.get(name) for name in
+                            ("bike1_ghost", "bike1_crashed_ghost", "bike2_ghost", "bike2_crashed_ghost")]
+        if scale == 1.0:
+            return self._images
+        images = self._scaled_images.get(scale)
+        if images is None:
+            images = self._scaled_images[scale] = [scale_image(image, scale) for image in self._images]
+        return images
+
+    def step(self, sim, frame):
+        """sim がティック frame を進めた直後に呼び、ゴーストを同じティックだけ進める
+
+        地面はコースの高さマップ、坂へのめり込みはこのティックで動く前の坂の位置（現在の位置 + SCROLL_SPEED）、
+        障害物は動いた後の位置で判定する（Simulation.step と同じ順番）。
+        """
+        if not self.count:
+            return
+        obstacles = sim.obstacles.sprites()
+        obstacle_x = np.array([o.rect.x for o in obstacles], dtype=np.int64)
+        obstacle_y = np.array([o.rect.y for o in obstacles], dtype=np.int64)
+        obstacle_w = np.array([o.width for o in obstacles], dtype=np.int64)
+        obstacle_h = np.array([o.height for o in obstacles], dtype=np.int64)
+        slopes = sim.slopes.sprites()
+        slope_x = np.array([s.rect.x + SCROLL_SPEED for s in slopes], dtype=np.int64)
+        slope_up = np.array([s.slope_type == "up" for s in slopes], dtype=bool)
+
+        # ジャンプ入力（リプレイの入力と、ティック開始時の障害物の位置で判定する反射ボット）
+        jump = np.zeros(self.count, dtype=bool)
+        for i, replay in enumerate(self.replays):
+            jump[i] = replay.inputs_at(frame)[0]
+        if len(obstacles):
+            distance = (obstacle_x + SCROLL_SPEED)[None, :] - (self.x + self.width)[:, None]
+            near = ((distance >= 0) & (distance <= self.lookahead[:, None])).any(axis=1)
+            jump |= self.is_bot & near
+        alive = ~self.crashed
+        start_jump = jump & alive & ~self.jumping
+        self.velocity_y = np.where(start_jump, self.jump_velocity, self.velocity_y)
+        self.jumping |= start_jump
+
+        # 重力と、坂を考慮した地面（コースの高さマップを全ゴーストの列でまとめて引く）
+        self.prev_y = self.y
+        velocity_y = np.where(alive, self.velocity_y + self.gravity, self.velocity_y)
+        y = np.where(alive, round_half_away(self.y + velocity_y), self.y)
+        columns = self.center_x + SCROLL_SPEED * frame
+        left = int(columns.min())
+        surface = np.frombuffer(sim.course.surfaces(left, int(columns.max()) + 1))[columns - left]
+        ground = np.where(np.isnan(surface), float(BIKE_GROUND_Y), surface - self.height)
+        landed = alive & (y >= ground)
+        y = np.where(landed, round_half_away(ground), y)
+        velocity_y = np.where(landed, 0.0, velocity_y)
+        self.jumping &= ~landed
+
+        # 坂にめり込んでいたら押し上げる（矩形が重なる坂だけ）
+        if len(slopes):
+            slope_top = GROUND_Y - Slope.HEIGHT
+            touching = (alive[:, None] & (slope_x[None, :] < (self.x + self.width)[:, None])
+                        & (self.x[:, None] < slope_x[None, :] + Slope.WIDTH)
+                        & (y[:, None] < slope_top + Slope.HEIGHT) & (slope_top < y[:, None] + self.height))
+            lift = np.zeros(self.count, dtype=np.int64)
+            for kind, depths in self.depths.items():
+                mine = (self.kind == kind) & touching.any(axis=1)
+                if mine.any():
+                    lift[mine] = slope_lift(depths, self.x[mine, None], self.width, y[mine, None],
+                                            slope_x[None, :], slope_up[None, :], touching[mine])
+            lifted = lift > 0
+            y = y - np.where(lifted, lift, 0)
+            settle = lifted & (velocity_y >= 0)
+            velocity_y = np.where(settle, 0.0, velocity_y)
+            self.jumping &= ~settle
+        self.y = y
+        self.velocity_y = velocity_y
+
+        # 障害物との衝突（矩形の重なりで候補を絞り、候補だけをマスクで精密に調べる）
+        if len(obstacles):
+            x = self.x[:, None]
+            y = self.y[:, None]
+            ghosts, hits = np.nonzero(alive[:, None] & (x < obstacle_x + obstacle_w) & (obstacle_x < x + self.width)
+                                      & (y < obstacle_y + obstacle_h) & (obstacle_y < y + self.height))
+            left = obstacle_x[hits] - self.x[ghosts]
+            top = obstacle_y[hits] - self.y[ghosts]
+            pixels = np.zeros(len(ghosts), dtype=np.int64)
+            for kind, table in self.summed_masks.items():
+                mine = self.kind[ghosts] == kind
+                pixels[mine] = opaque_in(table, left[mine], top[mine],
+                                         left[mine] + obstacle_w[hits[mine]], top[mine] + obstacle_h[hits[mine]])
+            crashed_now = np.zeros(self.count, dtype=bool)
+            crashed_now[ghosts[pixels > 0]] = True
+            self.crashed |= crashed_now
+            self.crash_frame[crashed_now] = frame
+
+        # クラッシュしたゴーストは地面と一緒に後ろへ流れる
+        self.draw_x = np.where(self.crashed, self.draw_x - SCROLL_SPEED, self.draw_x)
+
+    def draw(self, surface, alpha=1.0, scale=1.0):
+        """画面内のゴーストを1回の fblits でまとめて描画する（scale は内部解像度の倍率）"""
+        visible = self.draw_x > -self.width
+        y = np.rint(self.prev_y + (self.y - self.prev_y) * alpha).astype(np.int64)
+        # クラッシュしたゴーストは止まっているので補間しない（地面と同じ速さで流れる分だけ補間する）
+        x = np.where(self.crashed, self.draw_x + np.rint(SCROLL_SPEED * (1 - alpha)).astype(np.int64), self.draw_x)
+        if scale != 1.0:
+            x = np.rint(x * scale).astype(np.int64)
+            y = np.rint(y * scale).astype(np.int64)
+        images = self.images(scale)
+        image_index = (self.kind + self.crashed)[visible].tolist()
+        sequence = [(images[i], pos) for i, pos in zip(image_index, zip(x[visible].tolist(), y[visible].tolist()))]
+        if hasattr(surface, "fblits"):
+            surface.fblits(sequence)
+        else:
+            surface.blits(sequence, doreturn=False)
+
+    def status(self, sim):
+        """HUD に表示する残り台数と順位（プレイヤー1より長く生き残ったゴーストの数 + 1）"""
+        alive = int((~self.crashed).sum())
+        # プレイヤーがクラッシュしたティックより後までクラッシュしなかったゴーストが上位
+        ahead = int((self.crash_frame > sim.frame - 1).sum()) if sim.bike1.crashed else 0
+        return f"Ghosts {alive}/{self.count}  Rank {ahead + 1}/{self.count + 1}"
+
+def load_replays(paths):
+    replays = []
+    for path in paths:
+        try:
+            replays.append(Replay.load(path))
+        except ValueError as e:
+            raise SystemExit(f"{path}: {e}")
+    for path, replay in zip(paths, replays):
+        if replay.game_mode != "single":
+            raise SystemExit(f"{path}: only single-player replays can be used as ghosts")
+    if len({replay.seed for replay in replays}) > 1:
+        raise SystemExit("all ghost replays must be recorded on the same seed")
+    return replays
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="ゴーストレース")
+    parser.add_argument("--ghosts", type=int, default=128, help="ボットが操作するゴーストの台数")
+    parser.add_argument("--replay", action="append", default=[], metavar="FILE",
+                        help="ゴーストとして走らせるリプレイ（1人プレイ・同じシードのもの、複数指定可）")
+    parser.add_argument("--seed", type=seed_value, default=None, help="コースのシード（省略時はリプレイのシードかランダム）")
+    parser.add_argument("--record", metavar="FILE", help="自分の走りをリプレイとして書き出す（次のゴーストにできる）")
+    parser.add_argument("--autopilot", action="store_true", help="プレイヤーも先読みボットに操作させる")
+    parser.add_argument("--fps", type=int, default=60, help="描画フレームレートの上限（0 で上限なし）")
+    parser.add_argument("--profile", metavar="FILE", help="フレームごとの処理時間を書き出すファイル（.json または .csv）")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    replays = load_replays(args.replay)
+    seed = args.seed
+    if seed is None:
+        seed = replays[0].seed if replays else random.randrange(2 ** 32)
+    if replays and replays[0].seed != seed:
+        raise SystemExit(f"ghost replays were recorded on seed {replays[0].seed}, not {seed}")
+    print(f"Course seed {seed}, {len(replays) + args.ghosts} ghosts")
+
+    get_screen()
+    prepare_assets()
+    ghosts = GhostPack(args.ghosts, replays, seed)
+    restart = True
+    while restart:
+        # 同じコース・同じゴーストでやり直す
+        ghosts.reset()
+        autopilot = Autopilot([0]) if args.autopilot else None
+        game = Game("single", max_fps=args.fps, profile_path=args.profile, seed=seed, record_path=args.record,
+                    autopilot=autopilot, ghosts=ghosts)
+        restart = game.run()
+    pygame.quit()
+    sys.exit()
+
+if __name__ == "__main__":
+    main()
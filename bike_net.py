@@ -0,0 +1,461 @@
+"""UDP 通信による2人対戦（ロールバック方式）
+
+両方のクライアントが同じシードでシミュレーションを進める。相手の入力はまだ届いていなければ
+「押していない」と予測して先に進め、実際には押されていたことが分かったら、そのティックの状態まで
+巻き戻して再シミュレーションする。自分の入力は遅延なくそのティックに反映される。
+
+パケットには相手がまだ受け取っていない自分の入力をすべて載せるので、パケットが失われても
+次のパケットで補われる。1台で遅延・ゆらぎ・パケット損失を加えて試すループバックのテストもできる。
+
+    python bike_net.py --host 5000                       # ホスト（プレイヤー1）
+    python bike_net.py --connect 192.168.0.10:5000       # 参加（プレイヤー2）
+    python bike_net.py --loopback --latency 50 --jitter 10 --loss 0.05 --frames 1200
+"""
+import argparse
+import asyncio
+import json
+import random
+import struct
+import sys
+import time
+
+from bike_game import (SIM_DT, Game, Replay, Simulation, get_screen, percentile, prepare_assets, reflex_policy,
+                       seed_value)
+
+MAGIC = b"BKNT"
+JOIN, WELCOME, INPUT = range(3)
+HANDSHAKE = struct.Struct("<4sB")
+WELCOME_BODY = struct.Struct("<Q")
+# 送信側の現在ティック, 受信済みの相手の入力数, 送信時刻 ms, 相手の送信時刻 ms, その受信からの経過 ms,
+# 載せた入力の先頭ティック, 入力の数（続けて1ティック1ビットの入力）
+INPUT_HEADER = struct.Struct("<4sBIIIIHIB")
+MAX_INPUTS_PER_PACKET = 255
+MAX_PREDICTION = 12  # 相手の入力をこのティック数より先までは予測しない（超えたら待つ）
+CONNECT_TIMEOUT = 10.0
+
+def pack_bits(values):
+    bits = bytearray((len(values) + 7) // 8)
+    for i, value in enumerate(values):
+        if value:
+            bits[i >> 3] |= 1 << (i & 7)
+    return bytes(bits)
+
+def unpack_bits(data, count):
+    return [bool(data[i >> 3] >> (i & 7) & 1) for i in range(count)]
+
+class RollbackSession:
+    """ロールバック方式で2人対戦のシミュレーションを進める（通信とは独立）
+
+    local は自分のバイクの番号（0 または 1）。相手の入力は受信済みのものだけを確定とし、
+    未受信のティックは押していないと予測する（ジャンプは一瞬の入力なので「直前と同じ」より外れにくい）。
+    """
+    def __init__(self, seed, local, rules=None, max_prediction=MAX_PREDICTION):
+        self.sim = Simulation("two_player", seed, rules)
+        self.seed = self.sim.seed
+        self.local = local
+        self.max_prediction = max_prediction
+        self.frame = 0
+        self.local_inputs = []
+        self.remote_inputs = []  # 受信済み（確定）の相手の入力
+        # ティック番号 -> そのティックを進める前の状態（相手の入力が未確定のティックだけ）
+        self.snapshots = {}
+        self._oldest_snapshot = 0
+        self.rollback_from = None  # 予測が外れた最も古いティック
+        self.held = False  # 待機中に押された入力（次に進めるティックで反映）
+        # 統計
+        self.rollbacks = 0
+        self.resimulated = 0
+        self.max_depth = 0
+        self.stalls = 0
+        self.waits = 0
+        self.history = []  # advance ごとの再シミュレーションしたティック数
+
+    def add_remote_inputs(self, start, inputs):
+        """相手のティック start からの入力を受け取る（重複や古いものは無視）"""
+        if start > len(self.remote_inputs):
+            return
+        for frame in range(len(self.remote_inputs), start + len(inputs)):
+            pressed = inputs[frame - start]
+            self.remote_inputs.append(pressed)
+            # 押していないと予測して進めたティックで、実際には押されていたら巻き戻す
+            if pressed and frame < self.frame and (self.rollback_from is None or frame < self.rollback_from):
+                self.rollback_from = frame
+
+    def inputs_at(self, frame):
+        inputs = [False, False]
+        inputs[self.local] = self.local_inputs[frame]
+        if frame < len(self.remote_inputs):
+            inputs[1 - self.local] = self.remote_inputs[frame]
+        return inputs
+
+    def _step(self, frame):
+        if frame >= len(self.remote_inputs):
+            self.snapshots[frame] = self.sim.snapshot()
+        self.sim.step(self.inputs_at(frame))
+
+    def synchronize(self):
+        """予測が外れていたら巻き戻して再シミュレーションし、そのティック数を返す"""
+        start = self.rollback_from
+        if start is None:
+            return 0
+        self.rollback_from = None
+        self.sim.restore(self.snapshots[start])
+        for frame in range(start, self.frame):
+            self._step(frame)
+        depth = self.frame - start
+        self.rollbacks += 1
+        self.resimulated += depth
+        self.max_depth = max(self.max_depth, depth)
+        return depth
+
+    def advance(self, pressed, wait=False):
+        """自分の入力で1ティック進める
+
+        相手の入力が max_prediction ティック以上遅れているとき、または wait（時刻合わせ）のときは
+        進めずに False を返す。そのとき押された入力は次に進めるティックで反映する。
+        """
+        depth = self.synchronize()
+        self.history.append(depth)
+        pressed = pressed or self.held
+        if wait or self.frame - len(self.remote_inputs) >= self.max_prediction:
+            if wait:
+                self.waits += 1
+            else:
+                self.stalls += 1
+            self.held = pressed
+            return False
+        self.held = False
+        self.local_inputs.append(pressed)
+        self._step(self.frame)
+        self.frame += 1
+
+        # 確定したティックはもう巻き戻さないので状態を捨てる
+        confirmed = min(len(self.remote_inputs), self.frame)
+        while self._oldest_snapshot < confirmed:
+            self.snapshots.pop(self._oldest_snapshot, None)
+            self._oldest_snapshot += 1
+        return True
+
+    def stats(self):
+        ticks = len(self.history)
+        return {
+            "frames": self.frame,
+            "confirmed": min(len(self.remote_inputs), self.frame),
+            "rollbacks": self.rollbacks,
+            "resimulated": self.resimulated,
+            "resimulated_per_tick": self.resimulated / ticks if ticks else 0.0,
+            "rollback_depth_p99": percentile([depth for depth in self.history if depth], 99),
+            "rollback_depth_max": self.max_depth,
+            "stalls": self.stalls,
+            "waits": self.waits,
+        }
+
+class LossyLink:
+    """送信するパケットに遅延・ゆらぎ・損失を加える（1台での動作確認用）
+
+    latency は片道の遅延、jitter はそれに加わる 0〜jitter の揺らぎ（秒）。揺らぎでパケットの順序も入れ替わる。
+    """
+    def __init__(self, latency=0.0, jitter=0.0, loss=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rng = random.Random(seed)
+        self.sent = 0
+        self.dropped = 0
+
+    def send(self, transport, data, addr):
+        self.sent += 1
+        if self.loss and self.rng.random() < self.loss:
+            self.dropped += 1
+            return
+        delay = self.latency + self.rng.uniform(0, self.jitter) if self.jitter else self.latency
+        if delay <= 0:
+            transport.sendto(data, addr)
+        else:
+            asyncio.get_running_loop().call_later(delay, self._deliver, transport, data, addr)
+
+    @staticmethod
+    def _deliver(transport, data, addr):
+        if not transport.is_closing():
+            transport.sendto(data, addr)
+
+class NetPeer(asyncio.DatagramProtocol):
+    """UDP で相手と入力をやりとりし、RollbackSession を進める
+
+    local が 0 ならホスト（シードを決めて JOIN を待つ）、1 なら remote_addr のホストに参加する。
+    Game の session として渡すと、Game のティックごとに advance が呼ばれる。
+    """
+    def __init__(self, local, remote_addr=None, seed=None, link=None):
+        self.local = local
+        self.remote_addr = remote_addr
+        self.seed = seed if seed is not None else random.randrange(2 ** 32)
+        self.link = link or LossyLink()
+        self.session = None
+        self.transport = None
+        self.ready = None
+        self.remote_ack = 0  # 相手が受信済みの自分の入力の数
+        self.remote_frame = 0
+        self.echo_ms = None
+        self.echo_received = 0.0
+        self.rtts = []
+        self.advantage = 0.0
+        self.last_wait = 0
+        self.received = 0
+
+    @property
+    def sim(self):
+        return self.session.sim
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.ready = asyncio.Event()
+
+    def _start(self, seed):
+        self.session = RollbackSession(seed, self.local)
+        self.ready.set()
+
+    def send(self, data):
+        self.link.send(self.transport, data, self.remote_addr)
+
+    async def connect(self, timeout=CONNECT_TIMEOUT):
+        """相手と接続してセッションを始める"""
+        deadline = time.monotonic() + timeout
+        while not self.ready.is_set():
+            if time.monotonic() > deadline:
+                raise TimeoutError("no response from the other player")
+            if self.local == 1:
+                self.send(HANDSHAKE.pack(MAGIC, JOIN))
+            try:
+                await asyncio.wait_for(self.ready.wait(), 0.25)
+            except asyncio.TimeoutError:
+                pass
+
+    def datagram_received(self, data, addr):
+        if len(data) < HANDSHAKE.size or data[:4] != MAGIC:
+            return
+        kind = data[4]
+        if kind == JOIN and self.local == 0:
+            # JOIN が届くたびに WELCOME を返す（WELCOME が失われても参加側が再送する）
+            self.remote_addr = addr
+            self.send(HANDSHAKE.pack(MAGIC, WELCOME) + WELCOME_BODY.pack(self.seed))
+            if self.session is None:
+                self._start(self.seed)
+        elif kind == WELCOME and self.local == 1 and self.session is None:
+            (self.seed,) = WELCOME_BODY.unpack_from(data, HANDSHAKE.size)
+            self._start(self.seed)
+        elif kind == INPUT and self.session is not None:
+            self._receive_inputs(data)
+
+    def _receive_inputs(self, data):
+        _, _, frame, ack, sent_ms, echo_ms, hold_ms, start, count = INPUT_HEADER.unpack_from(data)
+        now = time.monotonic()
+        self.received += 1
+        self.session.add_remote_inputs(start, unpack_bits(data[INPUT_HEADER.size:], count))
+        self.remote_ack = max(self.remote_ack, ack)
+        if frame >= self.remote_frame:
+            self.remote_frame = frame
+            self.echo_ms = sent_ms
+            self.echo_received = now
+            if echo_ms != 0xFFFFFFFF:
+                self.rtts.append(max(0, (int(now * 1000) - echo_ms - hold_ms) & 0xFFFFFFFF))
+                # 相手の現在ティックの推定（受信したティック + 片道分）より自分がどれだけ先にいるか
+                one_way = self.rtts[-1] / 2000 / SIM_DT
+                self.advantage += 0.1 * (self.session.frame - (frame + one_way) - self.advantage)
+
+    def send_inputs(self):
+        """相手がまだ受け取っていない自分の入力を送る"""
+        session = self.session
+        start = self.remote_ack
+        inputs = session.local_inputs[start:start + MAX_INPUTS_PER_PACKET]
+        now = time.monotonic()
+        if self.echo_ms is None:
+            echo_ms, hold_ms = 0xFFFFFFFF, 0
+        else:
+            echo_ms, hold_ms = self.echo_ms, min(int((now - self.echo_received) * 1000), 0xFFFF)
+        header = INPUT_HEADER.pack(MAGIC, INPUT, session.frame, len(session.remote_inputs),
+                                   int(now * 1000) & 0xFFFFFFFF, echo_ms, hold_ms, start, len(inputs))
+        self.send(header + pack_bits(inputs))
+
+    def advance(self, pressed):
+        """1ティック進めて入力を送る
+
+        相手より2ティック以上先に進んでいたら、10ティックに1回だけ待って時刻を合わせる。
+        """
+        session = self.session
+        wait = self.advantage > 2 and session.frame - self.last_wait >= 10
+        if wait:
+            self.last_wait = session.frame
+            self.advantage -= 1
+        advanced = session.advance(pressed, wait)
+        self.send_inputs()
+        return advanced
+
+    def rtt_ms(self):
+        return percentile(self.rtts[-60:], 50) if self.rtts else 0
+
+    def status(self):
+        """HUD に表示する通信状態"""
+        session = self.session
+        return (f"RTT {self.rtt_ms():.0f} ms  rollback {session.history[-1] if session.history else 0}"
+                f" (max {session.max_depth})  stall {session.stalls}")
+
+    def stats(self):
+        return dict(self.session.stats(), rtt_ms_p50=percentile(self.rtts, 50), rtt_ms_p99=percentile(self.rtts, 99),
+                    packets_sent=self.link.sent, packets_dropped=self.link.dropped, packets_received=self.received)
+
+async def open_peer(local, local_addr, remote_addr=None, seed=None, link=None):
+    """UDP ソケットを開いて相手と接続した NetPeer を返す"""
+    loop = asyncio.get_running_loop()
+    _, peer = await loop.create_datagram_endpoint(lambda: NetPeer(local, remote_addr, seed, link),
+                                                  local_addr=local_addr)
+    await peer.connect()
+    return peer
+
+async def open_host(seed, link):
+    """ホスト側のソケットだけを開く（接続は connect で待つ）"""
+    loop = asyncio.get_running_loop()
+    _, peer = await loop.create_datagram_endpoint(lambda: NetPeer(0, None, seed, link),
+                                                  local_addr=("127.0.0.1", 0))
+    return peer
+
+async def play(peer, dirty=False, fps=60, profile_path=None):
+    """ウィンドウを開いて対戦する（描画の合間にイベントループでパケットを送受信する）"""
+    game = Game("two_player", dirty=dirty, max_fps=0, profile_path=profile_path, session=peer)
+    game.start()
+    loop = asyncio.get_running_loop()
+    next_frame = loop.time()
+    # Rキーで終わるときは handle_commands が統計を表示し、トレースとリプレイを書き出している
+    while game.run_frame() is None:
+        next_frame = max(next_frame + 1 / fps, loop.time() - 0.1)
+        await asyncio.sleep(max(0.0, next_frame - loop.time()))
+
+# 回線テストのボットがジャンプする障害物までの距離。ゲームが途中で終わらずに最後まで入力をやり取りするよう、
+# 反射ボットの既定値（REFLEX_LOOKAHEAD）ではなく、ほとんど倒れない 90 にする
+LOOPBACK_LOOKAHEAD = 90
+
+async def run_peer_ticks(peer, frames, lookahead, peers):
+    """ボットの入力で frames ティック進め、全員の入力が確定するまで送り続ける"""
+    loop = asyncio.get_running_loop()
+    session = peer.session
+    tick_times = []
+    next_tick = loop.time()
+    while session.frame < frames:
+        t = time.perf_counter()
+        pressed = reflex_policy(session.sim.get_state(), lookahead)[peer.local]
+        peer.advance(pressed)
+        tick_times.append(time.perf_counter() - t)
+        next_tick += SIM_DT
+        await asyncio.sleep(max(0.0, next_tick - loop.time()))
+    while not all(len(other.session.remote_inputs) >= frames for other in peers):
+        peer.send_inputs()
+        await asyncio.sleep(SIM_DT)
+    session.synchronize()
+    return tick_times
+
+async def run_loopback(frames=600, latency=0.0, jitter=0.0, loss=0.0, seed=None, lookahead=LOOPBACK_LOOKAHEAD):
+    """1台で2つのクライアントを UDP でつなぎ、遅延・損失のある回線でボット同士を対戦させる
+
+    最後に両者の状態と、確定した入力だけで最初から再生した状態のチェックサムを照合する。
+    """
+    link_seed = seed if seed is not None else random.randrange(2 ** 32)
+    host = await open_host(seed, LossyLink(latency, jitter, loss, link_seed))
+    client_task = asyncio.ensure_future(
+        open_peer(1, ("127.0.0.1", 0), host.transport.get_extra_info("sockname"),
+                  link=LossyLink(latency, jitter, loss, link_seed + 1)))
+    await host.connect()
+    client = await client_task
+    peers = [host, client]
+
+    tick_times = await asyncio.gather(*(run_peer_ticks(peer, frames, lookahead, peers) for peer in peers))
+    for peer in peers:
+        peer.transport.close()
+
+    # 確定した入力だけで最初から再生する
+    sim = Simulation("two_player", host.seed)
+    replay = Replay.start(sim)
+    for frame in range(frames):
+        inputs = [host.session.local_inputs[frame], client.session.local_inputs[frame]]
+        if not sim.game_over:
+            replay.record(sim.frame, inputs)
+        sim.step(inputs)
+    replay.finish(sim)
+
+    checksums = [peer.sim.checksum() for peer in peers]
+    results = []
+    for peer, times in zip(peers, tick_times):
+        stats = peer.stats()
+        stats["tick_ms_p50"] = percentile(times, 50) * 1000
+        stats["tick_ms_p99"] = percentile(times, 99) * 1000
+        stats["checksum"] = peer.sim.checksum()
+        stats["per_tick_resimulated"] = peer.session.history
+        results.append(stats)
+    return {
+        "seed": host.seed,
+        "frames": frames,
+        "link": {"latency_ms": latency * 1000, "jitter_ms": jitter * 1000, "loss": loss},
+        "reference_checksum": sim.checksum(),
+        "match": checksums[0] == checksums[1] == sim.checksum(),
+        "peers": results,
+    }, replay
+
+def parse_address(text):
+    host, _, port = text.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="UDP 通信による2人対戦（ロールバック方式）")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--host", type=int, metavar="PORT", help="ホストとして PORT で参加を待つ（プレイヤー1）")
+    group.add_argument("--connect", metavar="HOST:PORT", help="ホストに参加する（プレイヤー2）")
+    group.add_argument("--loopback", action="store_true", help="1台でボット同士を対戦させる回線テスト")
+    parser.add_argument("--seed", type=seed_value, default=None, help="乱数シード（ホストが決める）")
+    parser.add_argument("--latency", type=float, default=0.0, help="加える片道の遅延（ms）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="遅延に加わる揺らぎの最大値（ms）")
+    parser.add_argument("--loss", type=float, default=0.0, help="送信パケットの損失率（0〜1）")
+    parser.add_argument("--frames", type=int, default=600, help="ループバックテストのティック数")
+    parser.add_argument("--lookahead", type=int, default=LOOPBACK_LOOKAHEAD, help="ボットがジャンプする障害物までの距離")
+    parser.add_argument("--output", metavar="FILE", help="ループバックテストの結果（ティックごとの統計を含む）の JSON")
+    parser.add_argument("--record", metavar="FILE", help="ループバックテストのゲームをリプレイとして書き出す")
+    parser.add_argument("--dirty", action="store_true", help="変化した部分だけを画面に反映する描画モード")
+    parser.add_argument("--fps", type=int, default=60, help="描画フレームレートの上限")
+    parser.add_argument("--profile", metavar="FILE", help="フレームごとの処理時間を書き出すファイル")
+    return parser.parse_args(argv)
+
+async def main_async(args):
+    link = LossyLink(args.latency / 1000, args.jitter / 1000, args.loss)
+    if args.loopback:
+        result, replay = await run_loopback(args.frames, args.latency / 1000, args.jitter / 1000, args.loss,
+                                            args.seed, args.lookahead)
+        for name, stats in zip(("host", "client"), result["peers"]):
+            print(f"{name}: {stats['rollbacks']} rollbacks, {stats['resimulated']} resimulated ticks "
+                  f"({stats['resimulated_per_tick']:.2f}/tick, max {stats['rollback_depth_max']}), "
+                  f"{stats['stalls']} stalls, {stats['waits']} waits, RTT p50 {stats['rtt_ms_p50']:.0f} ms, "
+                  f"{stats['packets_dropped']}/{stats['packets_sent']} packets dropped, "
+                  f"tick p99 {stats['tick_ms_p99']:.2f} ms")
+        print(f"checksum {result['reference_checksum']:08x} ({'OK' if result['match'] else 'MISMATCH'})")
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(result, f, indent=2)
+        if args.record:
+            replay.save(args.record)
+        if not result["match"]:
+            sys.exit(1)
+        return
+
+    if args.host is not None:
+        print(f"Waiting for the other player on port {args.host}...")
+        peer = await open_peer(0, ("0.0.0.0", args.host), seed=args.seed, link=link)
+    else:
+        peer = await open_peer(1, ("0.0.0.0", 0), parse_address(args.connect), link=link)
+    print(f"Connected: player {peer.local + 1}, seed {peer.seed}")
+    # ウィンドウは接続してから開く
+    get_screen()
+    prepare_assets()
+    await play(peer, args.dirty, args.fps, args.profile)
+    print(json.dumps(peer.stats()))
+
+def main(argv=None):
+    asyncio.run(main_async(parse_args(argv)))
+
+if __name__ == "__main__":
+    main()
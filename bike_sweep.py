@@ -0,0 +1,161 @@
+"""難易度バランス調整のためのパラメータスイープ
+
+DEFAULT_RULES の値の組み合わせ（グリッド）ごとに多数のゲームをヘッドレスで実行し、
+生存ティック数とスコアの統計を設定ごとに集計する。ゲームはプロセスプールで全 CPU コアに分散し、
+終わったものから順に JSON Lines でファイルに書き出す。
+
+シードは「基準シード + ゲーム番号」で、どの設定でも同じシード列を使う（同じコースで設定を比較できる）。
+どのワーカーが実行しても結果は変わらない。
+
+    python bike_sweep.py --grid spawn_min=[30,40,50] --grid slope_chance=[0.5,0.7] --games 500 --output sweep.jsonl
+    python bike_sweep.py --grid 'weights=[[60,35,5],[50,35,15]]' --engine batch --games 20000
+"""
+import argparse
+import concurrent.futures
+import itertools
+import json
+import os
+import sys
+import time
+
+import bike_game
+from bike_game import DEFAULT_RULES, REFLEX_LOOKAHEAD, percentile
+
+def nesting_depth(value):
+    """リストの入れ子の深さ（リスト以外は 0）"""
+    if not isinstance(value, list):
+        return 0
+    return 1 + max((nesting_depth(item) for item in value), default=0)
+
+def parse_grid(assignments):
+    """NAME=JSON 形式の指定を (ルール名, 候補のリスト) の一覧にする
+
+    値の入れ子の深さが DEFAULT_RULES の値と同じなら1つの値、1段深ければ候補のリストとみなす
+    （weights なら [60,35,5] は1つの値、[[60,35,5],[50,35,15]] は2つの候補）。
+    """
+    grid = []
+    for assignment in assignments:
+        name, sep, value = assignment.partition("=")
+        if not sep:
+            raise SystemExit(f"--grid expects NAME=JSON, got {assignment!r}")
+        if name not in DEFAULT_RULES:
+            raise SystemExit(f"unknown rule: {name} (choose from {', '.join(DEFAULT_RULES)})")
+        try:
+            candidates = json.loads(value)
+        except json.JSONDecodeError as e:
+            raise SystemExit(f"--grid {name}: invalid JSON {value!r} ({e})")
+        depth = nesting_depth(DEFAULT_RULES[name])
+        if nesting_depth(candidates) == depth:
+            candidates = [candidates]
+        if (nesting_depth(candidates) != depth + 1 or not candidates
+                or any(nesting_depth(candidate) != depth for candidate in candidates)):
+            raise SystemExit(f"--grid {name}: expected a value shaped like {json.dumps(DEFAULT_RULES[name])} "
+                             f"or a list of such values, got {value}")
+        grid.append((name, candidates))
+    return grid
+
+def expand_grid(grid):
+    """グリッドのすべての組み合わせを、上書きするルールの辞書として返す"""
+    names = [name for name, _ in grid]
+    return [dict(zip(names, values)) for values in itertools.product(*(candidates for _, candidates in grid))]
+
+def run_task(task):
+    """1つの設定について seeds のゲームを実行する（ワーカープロセスで呼ばれる）"""
+    config_id, rules, seeds, game_mode, max_ticks, lookahead, engine = task
+    if engine == "batch":
+        from bike_batch import BatchSimulation
+        batch = BatchSimulation(seeds, game_mode, rules).run(max_ticks, lookahead)
+        games = zip(seeds, batch.frame.tolist(), batch.score.tolist(), batch.game_over.tolist())
+    else:
+        games = []
+        sim = bike_game.Simulation(game_mode, rules=rules)
+        for seed in seeds:
+            state = sim.reset(seed)
+            while not state["game_over"] and state["frame"] < max_ticks:
+                state = sim.step(bike_game.reflex_policy(state, lookahead))
+            games.append((seed, state["frame"], state["score"], state["game_over"]))
+    return [{"config": config_id, "seed": seed, "ticks": ticks, "score": round(score, 1), "crashed": crashed}
+            for seed, ticks, score, crashed in games]
+
+def summarize(configs, records):
+    """設定ごとの生存ティック数とスコアの統計"""
+    by_config = {config_id: [] for config_id in range(len(configs))}
+    for record in records:
+        by_config[record["config"]].append(record)
+
+    summary = []
+    for config_id, rules in enumerate(configs):
+        games = by_config[config_id]
+        ticks = [game["ticks"] for game in games]
+        scores = [game["score"] for game in games]
+        summary.append({
+            "config": config_id,
+            "rules": rules,
+            "games": len(games),
+            "crashed": sum(game["crashed"] for game in games),
+            "ticks_mean": sum(ticks) / len(ticks) if ticks else 0.0,
+            "ticks_p10": percentile(ticks, 10),
+            "ticks_p50": percentile(ticks, 50),
+            "ticks_p90": percentile(ticks, 90),
+            "score_mean": sum(scores) / len(scores) if scores else 0.0,
+            "score_p50": percentile(scores, 50),
+            "score_p90": percentile(scores, 90),
+            "score_max": max(scores, default=0.0),
+        })
+    return summary
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="難易度パラメータのスイープ")
+    parser.add_argument("--grid", action="append", default=[], metavar="NAME=JSON",
+                        help="スイープするルールと候補（例: spawn_min=[30,40,50]）。複数指定で全組み合わせ")
+    parser.add_argument("--games", type=int, default=200, help="設定ごとのゲーム数")
+    parser.add_argument("--seed", type=int, default=0, help="基準シード")
+    parser.add_argument("--mode", choices=["single", "two_player"], default="single")
+    parser.add_argument("--max-ticks", type=int, default=36000, help="1ゲームの最大ティック数")
+    parser.add_argument("--lookahead", type=int, default=REFLEX_LOOKAHEAD, help="反射ボットがジャンプする障害物までの距離")
+    parser.add_argument("--engine", choices=["sprite", "batch"], default="sprite",
+                        help="sprite: Simulation / batch: NumPy バッチシミュレータ")
+    parser.add_argument("--chunk", type=int, default=None, help="1タスクあたりのゲーム数")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="ワーカープロセス数")
+    parser.add_argument("--output", default="sweep.jsonl", help="ゲームごとの結果を書き出す JSON Lines ファイル")
+    parser.add_argument("--summary", default=None, help="設定ごとの集計を書き出す JSON ファイル（省略時は OUTPUT.summary.json）")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    configs = expand_grid(parse_grid(args.grid))
+    chunk = args.chunk or (500 if args.engine == "batch" else 25)
+    seeds = list(range(args.seed, args.seed + args.games))
+    tasks = [(config_id, rules, seeds[i:i + chunk], args.mode, args.max_ticks, args.lookahead, args.engine)
+             for config_id, rules in enumerate(configs)
+             for i in range(0, len(seeds), chunk)]
+    print(f"{len(configs)} configs x {args.games} games = {len(tasks)} tasks on {args.workers} workers",
+          file=sys.stderr)
+
+    records = []
+    start = time.perf_counter()
+    with open(args.output, "w") as out, \
+            concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(run_task, task) for task in tasks]
+        for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+            # 終わったタスクから順に書き出す（途中で止めてもそこまでの結果は残る）
+            for record in future.result():
+                out.write(json.dumps(record) + "\n")
+                records.append(record)
+            out.flush()
+            print(f"\r{done}/{len(tasks)} tasks, {time.perf_counter() - start:.1f}s", end="", file=sys.stderr)
+    print(file=sys.stderr)
+
+    summary = summarize(configs, records)
+    summary_path = args.summary or os.path.splitext(args.output)[0] + ".summary.json"
+    with open(summary_path, "w") as f:
+        json.dump({"args": vars(args), "defaults": DEFAULT_RULES, "configs": summary}, f, indent=2)
+
+    print(f"{'config':<48}{'games':>6}{'ticks p10':>10}{'p50':>8}{'p90':>8}{'score mean':>11}")
+    for row in summary:
+        label = ", ".join(f"{name}={value}" for name, value in row["rules"].items()) or "(defaults)"
+        print(f"{label[:47]:<48}{row['games']:>6}{row['ticks_p10']:>10}{row['ticks_p50']:>8}"
+              f"{row['ticks_p90']:>8}{row['score_mean']:>11.1f}")
+
+if __name__ == "__main__":
+    main()